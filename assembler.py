@@ -1,63 +1,351 @@
+import os
+import re
 import sys
-from getopt import getopt
+import json
+import mmap
+import time
+import cProfile
+import pickle
+import multiprocessing
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_right
+from functools import lru_cache, partial
+from getopt import gnu_getopt
+from types import MappingProxyType
+from typing import FrozenSet, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+from expression import Expression, Value, compile_expression, topological_order
+from include import expand_includes
+from macro import expand_macros
+from objfile import T_RECORD_SIZE, ObjectSection, TextStream, format_binary, format_text, write_object
+from sources import collect_sources, is_batch, output_name
+
+DIRECTIVES = frozenset([
+    'START',
+    'END',
+    'BYTE',
+    'WORD',
+    'RESW',
+    'RESB',
+    'BASE',
+    'CSECT',
+    'EXTDEF',
+    'EXTREF',
+    'LTORG',
+    'EQU',
+])
+# directives taking memory
+STORAGE_DIRECTIVES = frozenset(['BYTE', 'WORD', 'RESW', 'RESB'])
+# directives take symbol list and can not have symbol
+EXTERNAL_DIRECTIVES = frozenset(['EXTDEF', 'EXTREF'])
+# written as "SYMBOL MNEMONIC" without operand
+NO_OPERAND_MNEMONICS = frozenset(['FIX', 'FLOAT', 'HIO', 'NORM', 'SIO', 'TIO', 'CSECT', 'LTORG'])
+# format 2 with two operands "MNEMONIC r1,r2"
+REGISTER_PAIR_MNEMONICS = frozenset(['ADDR', 'COMPR', 'DIVR', 'MULR', 'RMO', 'SHIFTL', 'SHIFTR', 'SUBR'])
+
+# register number used by format 2
+REGISTER_CODE = {'A': 0, 'X': 1, 'L': 2, 'B': 3, 'S': 4, 'T': 5, 'F': 6, 'PC': 8, 'SW': 9}
+
+# ',' is a separator same as white space
+SEPARATOR_TABLE = str.maketrans(',', ' ')
+
+# bytes of C'...' or X'...' constant
+def constant_size(text) -> int:
+    data = text[2:].split('\'')[0]
+    if text[0] == 'C':
+        return len(data)
+    elif text[0] == 'X':
+        return len(data) // 2
+    return 0
+
+# read source line by line, optionally through mmap
+def read_lines(file_name, use_mmap=False):
+    with open(file_name, mode="rb" if use_mmap else "r") as f:
+        if not use_mmap:
+            yield from f
+            return
+        # mmap can not map empty file
+        if f.seek(0, 2) == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b''):
+                yield line.decode()
+
+# split lines into tokens, skip comment and empty line
+def tokenize(lines):
+    for index, line in enumerate(lines):
+        tokens = line.translate(SEPARATOR_TABLE).split()
+        if tokens and tokens[0] != '.':
+            yield index + 1, tokens
+
+DEFAULT_OPCODE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'opcode')
+
+class Opcode(NamedTuple):
+    format: Tuple[int, ...]     # e.g. (3, 4)
+    code: int
+
+# parsed opcode table, shared by every assembler using the same file
+class OpcodeTable(NamedTuple):
+    path: str
+    digest: str                 # sha256 of the opcode file
+    opcode: Mapping[str, Opcode]
+    mnemonics: FrozenSet[str]   # opcode and directive names
+
+# parse "MNEMONIC FORMAT CODE" lines
+def parse_opcode(text) -> dict:
+    opcode = {}
+    for line in text.splitlines():
+        opcode_arr = line.split()
+        if opcode_arr:
+            opcode[opcode_arr[0]] = Opcode(
+                tuple(int(format) for format in opcode_arr[1].split('/')),
+                int(opcode_arr[2], base=16),
+            )
+    return opcode
+
+# precompiled table is reused while the opcode file mtime or content is unchanged
+def read_opcode_cache(cache_path, stat, data=None) -> Optional[dict]:
+    try:
+        with open(cache_path, mode='rb') as f:
+            cache = pickle.load(f)
+    except (OSError, pickle.PickleError, EOFError):
+        return None
+    if (cache['mtime'], cache['size']) == (stat.st_mtime_ns, stat.st_size):
+        return cache
+    if data is not None and cache['digest'] == hashlib.sha256(data).hexdigest():
+        return cache
+    return None
+
+def write_opcode_cache(cache_path, stat, digest, opcode) -> None:
+    cache = {
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'digest': digest,
+        'opcode': {name: tuple(entry) for name, entry in opcode.items()},
+    }
+    # cache is optional, ignore read-only location
+    try:
+        with open(cache_path, mode='wb') as f:
+            pickle.dump(cache, f)
+    except OSError:
+        pass
+
+@lru_cache(maxsize=None)
+def _load_opcode_table(path, cache_path) -> OpcodeTable:
+    stat = os.stat(path)
+    cache = read_opcode_cache(cache_path, stat) if cache_path is not None else None
+
+    if cache is None:
+        with open(path, mode='rb') as f:
+            data = f.read()
+        if cache_path is not None:
+            # mtime changed, content may still be the same
+            cache = read_opcode_cache(cache_path, stat, data)
+        if cache is None:
+            digest = hashlib.sha256(data).hexdigest()
+            opcode = parse_opcode(data.decode())
+        else:
+            digest = cache['digest']
+            opcode = {name: Opcode(*entry) for name, entry in cache['opcode'].items()}
+        if cache_path is not None:
+            write_opcode_cache(cache_path, stat, digest, opcode)
+    else:
+        digest = cache['digest']
+        opcode = {name: Opcode(*entry) for name, entry in cache['opcode'].items()}
+
+    return OpcodeTable(path, digest, MappingProxyType(opcode), DIRECTIVES.union(opcode))
+
+# get opcode table, default is config/opcode next to this file
+def load_opcode_table(path=None, cache_path=None) -> OpcodeTable:
+    path = os.path.abspath(path if path is not None else DEFAULT_OPCODE_PATH)
+    if cache_path is not None:
+        cache_path = os.path.abspath(cache_path)
+    return _load_opcode_table(path, cache_path)
+
+# on disk cache of assembled control sections, least recently used entries are evicted
+class SectionCache:
+    VERSION = 6     # bump when cached entry layout or encoding changes
+
+    def __init__(self, directory, max_size=64 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    # content address of a section
+    @classmethod
+    def key(cls, *parts) -> str:
+        return hashlib.sha256(repr((cls.VERSION,) + parts).encode()).hexdigest()
+
+    def get(self, key) -> Optional[dict]:
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, mode='rb') as f:
+                entry = pickle.load(f)
+            # mark as recently used
+            os.utime(path)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+        return entry
+
+    def put(self, key, entry) -> None:
+        path = os.path.join(self.directory, key)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, mode='wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+
+    # remove least recently used entries until cache fits max_size
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+# one source line or generated literal
+class Instruction:
+    __slots__ = ('line', 'symbol', 'mnemonic', 'operand', 'location', 'opcode')
+
+    def __init__(self, line: int, symbol: str = None, mnemonic: str = None,
+                 operand: Union[str, List[str]] = None, location: int = None) -> None:
+        self.line = line
+        self.symbol = symbol
+        # mnemonic comes from a small vocabulary, share one string per name
+        self.mnemonic = sys.intern(mnemonic) if mnemonic is not None else None
+        self.operand = operand
+        self.location = location
+        self.opcode: List[int] = None
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Instruction):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ', '.join(
+            f'{name}={getattr(self, name)!r}' for name in self.__slots__[1:]
+            if getattr(self, name) is not None
+        )
+        return f'Instruction(line={self.line}, {fields})'
+
+# entry of the global symbol index
+class Symbol(NamedTuple):
+    section: Optional[str]      # defining control section, None if only referenced
+    value: Optional[int]
+    relocatable: bool           # False for EQU of absolute value
+    extdef: bool                # exported by defining section
+    extref: Tuple[str, ...]     # control sections importing it
+
+# problem found by check, column is 1 based
+class Diagnostic(NamedTuple):
+    line: int
+    column: int
+    severity: str               # 'error' or 'warning'
+    message: str
+
+# assembled program kept in memory
+class ObjectProgram:
+    __slots__ = ('sections', 'symbols', 'symbol_tables')
+
+    def __init__(self, sections: List[ObjectSection], symbols: dict, symbol_tables: dict) -> None:
+        self.sections = sections
+        self.symbols = symbols              # name -> Symbol across every control section
+        self.symbol_tables = symbol_tables  # section -> {name: value}, literals included
+
+    def __getitem__(self, name) -> ObjectSection:
+        for section in self.sections:
+            if section.name == name:
+                return section
+        raise KeyError(name)
+
+    # H/D/R/T/M/E records, one string per record
+    def records(self) -> Iterator[str]:
+        for line in format_text(self.sections):
+            if line != '\n':
+                yield line.rstrip('\n')
+
+    def text(self) -> str:
+        return ''.join(format_text(self.sections))
+
+    def binary(self) -> bytes:
+        return bytes(format_binary(self.sections))
+
+    def write(self, file_name, format='text') -> None:
+        write_object(file_name, self.sections, format)
+
+    def __repr__(self) -> str:
+        return f'ObjectProgram({[section.name for section in self.sections]!r})'
 
 class Assembler:
+    # pass two runs sections in parallel only for programs at least this many instructions
+    PARALLEL_THRESHOLD = 20000
+
     # init
-    def __init__(self) -> None:
-        self.__opcode = {}
+    def __init__(self, opcode_path=None, opcode_cache=None, jobs=1, stats=False, relax=False,
+                 auto_literals=False) -> None:
+        self.jobs = jobs    # worker processes for pass two
+        self.relax = relax  # size instructions as format 3 or 4 by displacement
+        self.auto_literals = auto_literals  # add literal pools where literals would be out of PC relative reach
+        self.include_cache = None   # SectionCache of tokenized INCLUDE files
+        self.__stats = stats
+        # opcode table is parsed once per process and shared
+        self.opcode_table = load_opcode_table(opcode_path, opcode_cache)
+        self.__opcode = self.opcode_table.opcode
+        self.__mnemonic_set = self.opcode_table.mnemonics
+        self.__encoder_table = self.__get_encoder_table(self.opcode_table)
+        self.reset()
+
+    # forget previous program, tables handed out before are not touched
+    def reset(self) -> None:
+        self.stats = {'phases': {}} if self.__stats else None    # filled by execute
+        self.__reused_sections = None   # sections taken from cache in incremental mode
+        self.__pool_records = 0         # literal pool records placed in incremental mode
+        self.__relaxed = 0              # instructions promoted to format 4 by relaxation
+        self.__relax_rounds = 0         # pass one runs of relaxation
+        self.literal_report = None      # literal pool placement against manual layout
+        self.__diagnostics = None       # errors and warnings kept by check, errors are raised otherwise
+        self.__source_lines = None      # source text of check, for columns
         self.instruction = []
-        self.__opcode_list = []
-        self.__directive_list = [
-            'START',
-            'END',
-            'BYTE',
-            'WORD',
-            'RESW',
-            'RESB',
-            'BASE',
-            'CSECT',
-            'EXTDEF',
-            'EXTREF',
-            'LTORG',
-            'EQU',
-        ]
+        self.line = None    # source line being processed, for error report
+        self.symbol_index = {}  # name -> Symbol across every control section
 
         self.__extdef_table = {}
         self.__extref_table = {}
         self.__symbol_table = {}
+        self.__absolute_table = {}  # EQU symbols of absolute value, per block
         self.__modified_record = {}
-        self.__literal_table = []
+        self.__literal_table = {}   # insertion ordered literal pool
+        self.__literal_pool = {}    # locations of every literal pool, per block
 
-        self.__init_opcode()
-        self.__get_format_list()
-    
-    # get opcode list
-    def __get_format_list(self) -> None:
-        self.__opcode_list = self.__opcode.keys()
-    
     # check mnemonic
     def __check_mnemonic(self, mneonic) -> bool:
         if mneonic[0] == '+':
-            return mneonic[1:] in self.__opcode_list
+            return mneonic[1:] in self.__opcode
         else:
-            return mneonic in self.__opcode_list or mneonic in self.__directive_list
-
-    # get opcode list
-    def __init_opcode(self) -> None:
-        with open("config/opcode", mode="r") as f:
-            for line in f.readlines():
-                opcode_arr = list(filter(None, line.split(" ")))
-                self.__opcode[opcode_arr[0]] = {
-                    "format": opcode_arr[1].split('/'),
-                    "code": int(opcode_arr[2].replace("\n", ""), base=16)
-                }
-    
+            return mneonic in self.__mnemonic_set
+
     # generate code list
     def __gen_code_list(self, opcode, type, format, offset) -> list:
         # format 4
         if format & 1 == 1:
             return [
-                self.__opcode[opcode]['code'] + type,
+                self.__opcode[opcode].code + type,
                 format << 4 | ((offset & 0xf0000) >> 16),
                 (offset & 0xff00) >> 8,
                 offset & 0xff,
@@ -65,673 +353,1711 @@ class Assembler:
         # format 3
         else:
             return [
-                self.__opcode[opcode]['code'] + type,
+                self.__opcode[opcode].code + type,
                 format << 4 | ((offset & 0xf00) >> 8),
                 offset & 0xff,
             ]
     
     # read file
-    def read_file(self, file_name) -> None:
-        format1_list = ['FIX', 'FLOAT', 'HIO', 'NORM', 'SIO', 'TIO', 'CSECT', 'LTORG']
-        format2_list = ['ADDR', 'COMPR', 'DIVR', 'MULR', 'RMO' 'SHIFTL', 'SHIFTR']
-
-        with open(file_name, mode="r") as f:
-            for index, line in enumerate(f.readlines()):
-                # read line remove ',', '\t', '\n' and split
-                line = line.replace(",", " ").replace("\t", " ").replace("\n", "")
-                instruction_arr = list(filter(None, line.split(" ")))
-
-                # filter comment and empty line
-                if not len(instruction_arr) or instruction_arr[0] == '.':
-                    continue
+    def read_file(self, file_name, use_mmap=False) -> None:
+        self.read_source(read_lines(file_name, use_mmap), file_name)
 
-                instruct_set = {}   # define instruction format
-
-                # special process EXTDEF
-                if 'EXTDEF' in instruction_arr:
-                    if instruction_arr.index('EXTDEF') != 0:
-                        raise SyntaxError(f'line {index + 1}: "EXTDEF can not have symbol"')
-                    
-                    instruct_set = {
-                        'mnemonic': instruction_arr[0],
-                        'operand': instruction_arr[1:],
-                    }
-                # special process EXTREF
-                elif 'EXTREF' in instruction_arr:
-                    if instruction_arr.index('EXTREF') != 0:
-                        raise SyntaxError(f'line {index + 1}: "EXTREF can not have symbol"')
-                    
-                    instruct_set = {
-                        'mnemonic': instruction_arr[0],
-                        'operand': instruction_arr[1:],
-                    }
-                # process length = 4
-                elif len(instruction_arr) == 4:
-                    if self.__check_mnemonic(instruction_arr[1]):
-                        instruct_set = {
-                            'symbol': instruction_arr[0],
-                            'mnemonic': instruction_arr[1],
-                            'operand': instruction_arr[2:],
-                        }
-                    else:
-                        raise SyntaxError(f'line {index + 1}: nonexistent symbol')
-                # process length = 3
-                elif len(instruction_arr) == 3:
-                    for mnemonic in format2_list:
-                        if mnemonic in instruction_arr:
-                            if instruction_arr.index(mnemonic) == 0:
-                                instruct_set = {
-                                    'mnemonic': instruction_arr[0],
-                                    'operand': instruction_arr[1:],
-                                }
-                                break
-                            else:
-                                raise SyntaxError(f'line {index + 1}: format error')
-                    # instruct has set and continue
-                    if len(instruct_set):
-                        self.instruction.append(instruct_set)
-                        continue
-
-                    # X exist
-                    if 'X' in instruction_arr:
-                        if self.__check_mnemonic(instruction_arr[0]):
-                            instruct_set = {
-                                'mnemonic': instruction_arr[0],
-                                'operand': instruction_arr[1:],
-                            }
-                    
-                    if len(instruct_set):
-                        self.instruction.append(instruct_set)
-                        continue
-
-                    if self.__check_mnemonic(instruction_arr[1]):
-                        instruct_set = {
-                            'symbol': instruction_arr[0],
-                            'mnemonic': instruction_arr[1],
-                            'operand': instruction_arr[2],
-                        }
-                    else:
-                        raise SyntaxError(f'line {index + 1}: nonexistent symbol')
-                # proces length = 2
-                elif len(instruction_arr) == 2:
-                    for mnemonic in format1_list:
-                        if mnemonic in instruction_arr:
-                            if instruction_arr.index(mnemonic) == 1:
-                                instruct_set = {
-                                    'symbol': instruction_arr[0],
-                                    'mnemonic': instruction_arr[1],
-                                }
-                                break
-                            else:
-                                raise SyntaxError(f'line {index + 1}: format error')
-                    # instruct has set and continue
-                    if len(instruct_set):
-                        self.instruction.append(instruct_set)
-                        continue
-                    
-                    if instruction_arr[0] == 'EQU':
-                        raise SyntaxError(f'line {index + 1}: EQU must have symbol')
-                    elif self.__check_mnemonic(instruction_arr[0]):
-                        instruct_set = {
-                            'mnemonic': instruction_arr[0],
-                            'operand': instruction_arr[1],
-                        }
-                    else:
-                        raise SyntaxError(f'line {index + 1}: nonexistent symbol')
-                else:
-                    if self.__check_mnemonic(instruction_arr[0]):
-                        instruct_set = {
-                            'mnemonic': instruction_arr[0],
-                        }
-                    else:
-                        raise SyntaxError(f'line {index + 1}: nonexistent symbol')
-
-                self.instruction.append(instruct_set)
+    # read source lines from memory, includes and macros are expanded on the way
+    #   file_name : source the lines come from, INCLUDE is relative to it
+    def read_source(self, lines, file_name=None) -> None:
+        for line_no, tokens in self.__source_tokens(lines, file_name):
+            self.instruction.append(self.__parse_tokens(line_no, tokens))
+
+    def __source_tokens(self, lines, file_name) -> Iterator[Tuple[int, List[str]]]:
+        if file_name is None:
+            directory, including = None, ()
+        else:
+            directory, including = os.path.dirname(file_name), (os.path.realpath(file_name),)
+        tokens = expand_includes(tokenize(lines), tokenize, directory, self.include_cache, including)
+        return expand_macros(tokens, self.__mnemonic_set)
+
+    # convert one tokenized line into an instruction record
+    def __parse_tokens(self, line_no, tokens) -> Instruction:
+        size = len(tokens)
+
+        # special process EXTDEF and EXTREF
+        if tokens[0] in EXTERNAL_DIRECTIVES:
+            return Instruction(line_no, mnemonic=tokens[0], operand=tokens[1:])
+        elif size > 1 and tokens[1] in EXTERNAL_DIRECTIVES:
+            raise SyntaxError(f'line {line_no}: "{tokens[1]} can not have symbol"')
+        # process length = 4
+        elif size == 4:
+            if self.__check_mnemonic(tokens[1]):
+                return Instruction(line_no, symbol=tokens[0], mnemonic=tokens[1], operand=tokens[2:])
+            raise SyntaxError(f'line {line_no}: nonexistent symbol')
+        # process length = 3
+        elif size == 3:
+            # register pair instruction can not have symbol
+            if tokens[0] in REGISTER_PAIR_MNEMONICS:
+                # opcode table may not define every register pair mnemonic
+                if not self.__check_mnemonic(tokens[0]):
+                    raise SyntaxError(f'line {line_no}: nonexistent symbol')
+                return Instruction(line_no, mnemonic=tokens[0], operand=tokens[1:])
+            elif tokens[1] in REGISTER_PAIR_MNEMONICS or tokens[2] in REGISTER_PAIR_MNEMONICS:
+                raise SyntaxError(f'line {line_no}: format error')
+
+            # X exist
+            if 'X' in tokens and self.__check_mnemonic(tokens[0]):
+                return Instruction(line_no, mnemonic=tokens[0], operand=tokens[1:])
+
+            if self.__check_mnemonic(tokens[1]):
+                return Instruction(line_no, symbol=tokens[0], mnemonic=tokens[1], operand=tokens[2])
+            raise SyntaxError(f'line {line_no}: nonexistent symbol')
+        # proces length = 2
+        elif size == 2:
+            if tokens[1] == 'START':
+                raise SyntaxError(f'line {line_no}: START must have start address')
+            # instruction without operand must be preceded by symbol
+            if tokens[1] in NO_OPERAND_MNEMONICS:
+                return Instruction(line_no, symbol=tokens[0], mnemonic=tokens[1])
+            elif tokens[0] in NO_OPERAND_MNEMONICS:
+                raise SyntaxError(f'line {line_no}: format error')
+
+            if tokens[0] == 'EQU':
+                raise SyntaxError(f'line {line_no}: EQU must have symbol')
+            elif self.__check_mnemonic(tokens[0]):
+                return Instruction(line_no, mnemonic=tokens[0], operand=tokens[1])
+            raise SyntaxError(f'line {line_no}: nonexistent symbol')
+        else:
+            if self.__check_mnemonic(tokens[0]):
+                return Instruction(line_no, mnemonic=tokens[0])
+            raise SyntaxError(f'line {line_no}: nonexistent symbol')
     
     # pass one
     def pass_one(self) -> None:
+        if self.auto_literals:
+            self.instruction = self.place_literal_pools(self.instruction)
+        self.instruction = self.__sized_pass_one(self.instruction, None)
+
+    # where code can not fall through: after J and RSUB, before RESW and RESB
+    # LTORG and END place a literal pool, --auto-ltorg also places one before CSECT
+    SAFE_AFTER = frozenset(['J', '+J', 'RSUB', '+RSUB'])
+    SAFE_BEFORE = frozenset(['RESW', 'RESB'])
+    POOL_END = frozenset(['LTORG', 'END', 'CSECT'])
+
+    # follow the location counter as pass one does, literal pools are also added before positions in pools
+    # pending literals are carried over CSECT as pass one does, a pool in another section is out of reach
+    # return literal uses (position, location, literal), pool points (position, location, mnemonic),
+    # uses out of PC relative reach and bytes of literal pools
+    def __literal_layout(self, instructions, pools=()) -> tuple:
+        uses = []
+        points = []
+        far = 0
+        pool_bytes = 0
+        pending = {}    # literal -> (section, location) of uses waiting for a pool
+        location = 0
+        section = 0     # control sections started so far
+
+        def flush() -> None:
+            nonlocal far, pool_bytes, location
+            offset = 0
+            for literal, used in pending.items():
+                far += sum(
+                    used_section != section or location + offset - (use + 3) > 2047
+                    for used_section, use in used)
+                offset += constant_size(literal[1:])
+            pool_bytes += offset
+            location += offset
+            pending.clear()
+
+        for position, instr in enumerate(instructions):
+            if position in pools:
+                flush()
+            mnemonic = instr.mnemonic
+            if mnemonic in self.SAFE_BEFORE:
+                points.append((position, location, mnemonic))
+            elif mnemonic in self.POOL_END:
+                points.append((position, location, mnemonic))
+                if mnemonic != 'CSECT':
+                    flush()
+            if mnemonic == 'START' or mnemonic == 'CSECT':
+                location = 0
+                section += 1
+            elif instr.operand is not None and mnemonic not in DIRECTIVES:
+                operand = instr.operand[0] if isinstance(instr.operand, list) else instr.operand
+                if operand[0] == '=':
+                    uses.append((position, location, operand))
+                    pending.setdefault(operand, []).append((section, location))
+            if mnemonic not in DIRECTIVES or mnemonic in STORAGE_DIRECTIVES:
+                location += self.__size(instr)
+            if mnemonic in self.SAFE_AFTER:
+                points.append((position + 1, location, mnemonic))
+        return uses, points, far, pool_bytes
+
+    # add LTORG at safe points so that literals stay in PC relative reach of their pool
+    # a pool is placed at a safe point when waiting for the next one would put a waiting literal out of reach
+    def place_literal_pools(self, instructions) -> list:
+        uses, points, far, pool_bytes = self.__literal_layout(instructions)
+        chosen = []
+        shift = 0           # bytes of pools added before this point in the section
+        pending = {}        # literal -> size, waiting for a pool
+        first_use = None    # location of the earliest use waiting for a pool
+        use = 0
+        for index, (position, location, mnemonic) in enumerate(points):
+            while use < len(uses) and uses[use][0] < position:
+                _, used, literal = uses[use]
+                pending[literal] = constant_size(literal[1:])
+                first_use = used + shift if first_use is None else first_use
+                use += 1
+            if mnemonic in self.POOL_END:
+                # literals of a control section are placed before the next one starts
+                if mnemonic == 'CSECT' and pending:
+                    chosen.append(position)
+                if mnemonic != 'LTORG':
+                    shift = 0
+                pending.clear()
+                first_use = None
+            elif pending:
+                size = sum(pending.values())
+                following = points[index + 1][1] + shift if index + 1 < len(points) else None
+                if following is None or following + size - (first_use + 3) > 2047:
+                    chosen.append(position)
+                    shift += size
+                    pending.clear()
+                    first_use = None
+
+        chosen = set(chosen)
+        _, _, auto_far, auto_pool_bytes = self.__literal_layout(instructions, chosen)
+        # every reference out of reach takes format 4, one byte more
+        self.literal_report = {
+            'literal_pools_added': len(chosen),
+            'far_literals_manual': far,
+            'far_literals_auto': auto_far,
+            'literal_bytes_saved': (far + pool_bytes) - (auto_far + auto_pool_bytes),
+        }
+
+        program = []
+        for position, instr in enumerate(instructions):
+            if position in chosen:
+                program.append(Instruction(instr.line, mnemonic='LTORG'))
+            program.append(instr)
+        return program
+
+    def __sized_pass_one(self, instructions, b_loc) -> list:
+        if self.relax:
+            return self.__relax(instructions, b_loc)
+        return self.__pass_one(instructions)
+
+    # every instruction starts as format 3, the ones whose displacement does not fit become format 4
+    # sizes only grow, so pass one is run again until no instruction is promoted
+    #   b_loc : BASE value when the first instruction is reached
+    def __relax(self, instructions, b_loc) -> list:
+        # state pass one carries between sections, restored before each run
+        literal_table = dict(self.__literal_table)
+        symbol_index = dict(self.symbol_index)
+        worklist = [
+            instr for instr in instructions
+            if instr.operand is not None and instr.mnemonic in self.__opcode
+            and self.__opcode[instr.mnemonic].format[0] == 3
+        ]
+        while True:
+            self.__literal_table = dict(literal_table)
+            self.symbol_index = dict(symbol_index)
+            program = self.__pass_one(instructions)
+            self.__relax_rounds += 1
+            if not worklist:
+                return program
+
+            pending = {id(instr) for instr in worklist}
+            promoted = set()
+            decided = set()
+            block = None
+            base = b_loc
+            for instr in program:
+                if instr.mnemonic == 'START' or instr.mnemonic == 'CSECT':
+                    block = instr.symbol
+                elif instr.mnemonic == 'BASE':
+                    base = self.__symbol_table[block].get(instr.operand)
+                elif id(instr) in pending:
+                    result = self.__needs_format4(instr, block, base)
+                    if result is None:
+                        decided.add(id(instr))
+                    elif result:
+                        promoted.add(id(instr))
+            for instr in worklist:
+                if id(instr) in promoted:
+                    instr.mnemonic = sys.intern('+' + instr.mnemonic)
+            self.__relaxed += len(promoted)
+            worklist = [instr for instr in worklist if id(instr) not in promoted and id(instr) not in decided]
+            if not promoted:
+                return program
+
+    # True when format 3 can not reach the operand, None when it never depends on locations
+    def __needs_format4(self, instr, block, base) -> Optional[bool]:
+        symbols = self.__symbol_table[block]
+        operand = instr.operand[0] if isinstance(instr.operand, list) else instr.operand
+        if operand[0] == '#':
+            token = operand[1:]
+            if token.isdigit():
+                return True if int(token) > 4095 else None
+            target = symbols.get(token)
+            if target is None:
+                return None
+            # absolute value is not relative to PC or BASE, it may still change with locations
+            if token in self.__absolute_table[block]:
+                return target > 4095
+        elif operand[0] == '@':
+            target = symbols.get(operand[1:])
+            if target is None:
+                return None
+        elif operand[0] == '=':
+            pools = self.__literal_pool[block].get(operand)
+            if not pools:
+                return None
+            target = pools[min(bisect_right(pools, instr.location), len(pools) - 1)]
+        else:
+            target = symbols.get(operand)
+            # external symbol is fixed by loader in format 4 only
+            if target is None:
+                return True if operand in self.__extref_table[block] else None
+
+        offset = target - instr.location - 3
+        if -2048 <= offset <= 2047:
+            return False
+        return base is None or not 0 <= target - base <= 4095
+
+    # pass one over whole program or a run of control sections, return them with literal pools
+    def __pass_one(self, instructions) -> list:
         cur_block = None        # record current program block
         cur_location = None     # record memory location
         cur_symbol_table = {}   # record current symbol table
         cur_extref_table = []   # record current extref table
+        cur_literal_pool = {}   # record current literal pool locations
+        cur_equ = []            # record current EQU, resolved when section closes
+        program = []            # instructions with literal pools placed
+        started = ended = False # START and END seen, a source holds one program
 
-        for index, instr in enumerate(self.instruction):
+        for instr in instructions:
+            self.line = instr.line
+            program.append(instr)
+            # locations are counted from START or CSECT, check goes on from 0
+            if cur_location is None and instr.mnemonic != 'START' and instr.mnemonic != 'CSECT':
+                self.__error(instr.line, 'missing START or start address before this line', instr.mnemonic)
+                cur_location = 0
+                cur_block = ''
+                self.__extdef_table[cur_block] = {}
             # add literal
-            if 'operand' in instr and instr['operand'][0] == '=':
-                if instr['operand'] not in self.__literal_table:
-                    self.__literal_table.append(instr['operand'])
+            if instr.operand is not None and instr.operand[0] == '=':
+                if instr.operand not in self.__literal_table:
+                    self.__literal_table[instr.operand] = None
             
             # directive operation
-            if instr['mnemonic'] == 'START':
-                cur_block = instr['symbol']     # update current program block
+            if instr.mnemonic == 'START':
+                if started:
+                    self.__error(instr.line, 'duplicate START, a source holds one program', instr.mnemonic)
+                    continue
+                started = True
+                cur_block = instr.symbol     # update current program block
                 cur_symbol_table.clear()        # reset symbol table
                 cur_extref_table.clear()        # reset extref table
+                cur_literal_pool.clear()        # reset literal pool
+                cur_equ.clear()                 # reset EQU list
                 self.__literal_table.clear()    # reset literal table
+                self.symbol_index.clear()       # reset symbol index
                 self.__extdef_table.clear()     # reset extdef table
                 self.__extref_table.clear()     # reset extref table
                 cur_location = 0                # for relocation program, start with 0
-                instr['location'] = cur_location
+                instr.location = cur_location
                 self.__extdef_table[cur_block] = {}     # init dict
             # add extdef symbol
-            elif instr['mnemonic'] == 'EXTDEF':
-                for ext_def in instr['operand']:
+            elif instr.mnemonic == 'EXTDEF':
+                for ext_def in instr.operand:
                     self.__extdef_table[cur_block][ext_def] = None
             # add extref symbol
-            elif instr['mnemonic'] == 'EXTREF':
-                cur_extref_table += instr['operand']
-            # declare variable
-            elif instr['mnemonic'] == 'RESW':
-                instr['location'] = cur_location
-                cur_location += int(instr['operand']) * 3
-            elif instr['mnemonic'] == 'RESB':
-                instr['location'] = cur_location
-                cur_location += int(instr['operand'])
+            elif instr.mnemonic == 'EXTREF':
+                cur_extref_table += instr.operand
             # clear literal
-            elif instr['mnemonic'] == 'LTORG' or instr['mnemonic'] == 'END':
-                it = index  # record next literal position
+            elif instr.mnemonic == 'LTORG' or instr.mnemonic == 'END':
                 for literal in self.__literal_table:
-                    it += 1
                     cur_symbol_table[literal] = cur_location
-                    # add new instruction at next one
-                    self.instruction.insert(it, {
-                        'symbol': '*',
-                        'mnemonic': literal,
-                        'location': cur_location
-                    })
+                    # same literal may be placed again by later LTORG
+                    cur_literal_pool.setdefault(literal, []).append(cur_location)
+                    # literal pool follows LTORG or END
+                    program.append(Instruction(
+                        instr.line, symbol='*', mnemonic=literal, location=cur_location))
                     # compute memory displacement
-                    if literal[1] == 'C':
-                        cur_location += len(list(literal[3:].split('\''))[0])
-                    elif literal[1] == 'X':
-                        cur_location += len(list(literal[3:].split('\''))[0]) // 2
+                    cur_location += constant_size(literal[1:])
                 self.__literal_table.clear()
                 # update symbol table
-                if instr['mnemonic'] == 'END':
+                if instr.mnemonic == 'END':
+                    if ended:
+                        self.__error(instr.line, 'duplicate END, a source holds one program', instr.mnemonic)
+                    ended = True
                     # [notice]: must use copy before reset
-                    self.__symbol_table[cur_block] = cur_symbol_table.copy()
-                    self.__extref_table[cur_block] = cur_extref_table.copy()
+                    if cur_block is not None:
+                        self.__close_section(
+                            cur_block, cur_symbol_table, cur_extref_table, cur_literal_pool, cur_equ)
                     cur_symbol_table.clear()
                     cur_extref_table.clear()
+                    cur_literal_pool.clear()
+                    cur_equ.clear()
                     self.__literal_table.clear()
+                    cur_block = None
             # define memory position
-            elif instr['mnemonic'] == 'EQU':
-                if instr['operand'] == '*':
-                    instr['location'] = cur_location
+            elif instr.mnemonic == 'EQU':
+                # value of '*' in expression
+                instr.location = cur_location
             # reset and use new block
-            elif instr['mnemonic'] == 'CSECT':
+            elif instr.mnemonic == 'CSECT':
                 cur_location = 0
-                instr['location'] = cur_location
+                instr.location = cur_location
                 # [notice]: must use copy before reset
-                self.__symbol_table[cur_block] = cur_symbol_table.copy()
-                self.__extref_table[cur_block] = cur_extref_table.copy()
-                cur_block = instr['symbol']
+                if cur_block is not None:
+                    self.__close_section(
+                        cur_block, cur_symbol_table, cur_extref_table, cur_literal_pool, cur_equ)
+                cur_block = instr.symbol
                 self.__extdef_table[cur_block] = {}
                 self.__extref_table[cur_block] = []
                 cur_symbol_table.clear()
                 cur_extref_table.clear()
-            # const variable
-            elif instr['mnemonic'] == 'BYTE':
-                instr['location'] = cur_location
-                # uncertain the number of byte, must be calculated first
-                if instr['operand'][0] == 'X':
-                    cur_location += len(list(instr['operand'][2:].split('\''))[0]) // 2
-                elif instr['operand'][0] == 'C':
-                    cur_location += len(list(instr['operand'][2:].split('\''))[0])
-            elif instr['mnemonic'] == 'WORD':
-                # WORD length must be equal to 3
-                instr['location'] = cur_location
-                cur_location += 3
-            # format 4
-            elif instr['mnemonic'][0] == '+':
-                instr['location'] = cur_location
-                cur_location += 4
+                cur_literal_pool.clear()
+                cur_equ.clear()
+            # skip added literal instrcution and BASE
+            elif instr.symbol == '*' or instr.mnemonic == 'BASE':
+                pass
+            # declare variable, const variable or instruction
             else:
-                # skip added literal instrcution and BASE
-                if 'symbol' in instr and instr['symbol'] == '*' or instr['mnemonic'] == 'BASE':
-                    pass
-                else:
-                    instr['location'] = cur_location
-                    opcode = instr['mnemonic'][1:] if instr['mnemonic'][0] == '+' else instr['mnemonic']
-                    format = self.__opcode[opcode]['format'][0]
-                    # format 1
-                    if format == '1':
-                        cur_location += 1
-                    # format 2
-                    elif format == '2':
-                        cur_location += 2
-                    # format 3
-                    else:
-                        cur_location += 3
+                instr.location = cur_location
+                cur_location += self.__size(instr)
             
-            # calculate EQU with symbol
-            if instr['mnemonic'] == 'EQU':
-                # add literal in symbol table
-                if instr['operand'] == '*':
-                    cur_symbol_table[instr['symbol']] = instr['location']
-                elif '-' in instr['operand']:
-                    symbol_1, symbol_2 = instr['operand'].split('-')
-                    cur_symbol_table[instr['symbol']] = \
-                        cur_symbol_table[symbol_1] - \
-                        cur_symbol_table[symbol_2]
-                elif '+' in instr['operand']:
-                    symbol_1, symbol_2 = instr['operand'].split('+')
-                    cur_symbol_table[instr['symbol']] = \
-                        cur_symbol_table[symbol_1] + \
-                        cur_symbol_table[symbol_2]
+            # assembler keeps the last definition, check reports the others
+            if (self.__diagnostics is not None and instr.symbol is not None
+                    and instr.symbol in cur_symbol_table and instr.mnemonic not in ('START', 'CSECT')):
+                self.__error(instr.line, f'duplicate symbol {instr.symbol}', instr.symbol)
+
+            # EQU may refer to symbols defined later, keep its place in symbol table
+            if instr.mnemonic == 'EQU':
+                self.__compile(instr)
+                cur_symbol_table[instr.symbol] = None
+                cur_equ.append(instr)
             # add other symbol in symbol table
-            elif 'symbol' in instr and instr['symbol'] != '*':
-                cur_symbol_table[instr['symbol']] = instr['location']
+            elif instr.symbol is not None and instr.symbol != '*':
+                cur_symbol_table[instr.symbol] = instr.location
 
-            if 'symbol' in instr:
-                if instr['symbol'] in self.__extdef_table[cur_block]:
-                    self.__extdef_table[cur_block][instr['symbol']] = instr['location']
-            
-    # pass two
-    def pass_two(self) -> None:
-        b_loc = None            # rocord register BASE
-        cur_block = None        # specify current program block
-        cur_modified_list = []  # record current program block M records
-        # these has processed in pass one, skip
-        skip_instr = ['EXTDEF', 'EXTREF', 'RESW', 'RESB', 'LTORG', 'EQU']
-        for index, instr in enumerate(self.instruction):
-            if instr['mnemonic'] in skip_instr:
+        # instructions end before END, close the last control section
+        if cur_block is not None:
+            self.__close_section(
+                cur_block, cur_symbol_table, cur_extref_table, cur_literal_pool, cur_equ)
+        return program
+
+    # raise error, or keep it and go on when checking
+    def __error(self, line, message, token=None, severity='error') -> None:
+        if self.__diagnostics is None:
+            raise SyntaxError(f'line {line}: {message}')
+        self.__diagnostics.append(Diagnostic(line, self.__column(line, token), severity, message))
+
+    # keep error raised as "line <n>: <message>"
+    def __keep_error(self, error, token=None) -> None:
+        message = str(error)
+        line = self.line
+        if message.startswith('line '):
+            number, _, message = message[5:].partition(': ')
+            line = int(number)
+        self.__error(line, message, token)
+
+    # column of token in source line, 1 when it can not be found
+    def __column(self, line, token) -> int:
+        if token is None or self.__source_lines is None or not 0 < line <= len(self.__source_lines):
+            return 1
+        match = re.search(r'(?<![\w$])' + re.escape(token) + r'(?![\w$])', self.__source_lines[line - 1])
+        return match.start() + 1 if match is not None else 1
+
+    # bytes taken by an instruction, RESW, RESB, BYTE or WORD
+    def __size(self, instr) -> int:
+        if instr.mnemonic == 'RESW':
+            return int(instr.operand) * 3
+        elif instr.mnemonic == 'RESB':
+            return int(instr.operand)
+        elif instr.mnemonic == 'BYTE':
+            # uncertain the number of byte, must be calculated first
+            return constant_size(instr.operand)
+        elif instr.mnemonic == 'WORD':
+            # WORD length must be equal to 3
+            return 3
+        # format 4
+        elif instr.mnemonic[0] == '+':
+            return 4
+        # format 1, 2 or 3 takes as many bytes
+        return self.__opcode[instr.mnemonic].format[0]
+
+    # keep tables of a finished control section and add its symbols to the index
+    def __close_section(self, block, symbol_table, extref_table, literal_pool, equ_list) -> None:
+        absolute = set()
+        self.__resolve_equ(symbol_table, extref_table, equ_list, absolute)
+        extdef = self.__extdef_table[block]
+        for name in extdef:
+            extdef[name] = symbol_table.get(name)
+        self.__symbol_table[block] = symbol_table.copy()
+        self.__extref_table[block] = extref_table.copy()
+        self.__literal_pool[block] = literal_pool.copy()
+        self.__absolute_table[block] = absolute
+        self.__index_section(block)
+
+    # parsed operand of EQU or WORD
+    def __compile(self, instr) -> Expression:
+        operand = instr.operand if isinstance(instr.operand, str) else ' '.join(instr.operand)
+        try:
+            return compile_expression(operand)
+        except ValueError as e:
+            self.__error(instr.line, str(e), operand)
+            return compile_expression('0')
+
+    # evaluate EQU of a section in dependency order, add symbols of absolute value to absolute
+    def __resolve_equ(self, symbol_table, extref_table, equ_list, absolute) -> None:
+        equ = {instr.symbol: instr for instr in equ_list}
+        expressions = {name: self.__compile(instr) for name, instr in equ.items()}
+        # forward references are resolved once, however long the chain is
+        order, cycle = topological_order({name: expression.symbols for name, expression in expressions.items()})
+        for name in cycle:
+            self.__error(equ[name].line, 'circular EQU definition', name)
+            symbol_table[name] = 0
+            absolute.add(name)
+
+        def resolve(name) -> Value:
+            value = symbol_table.get(name)
+            if value is None:
+                if name in extref_table:
+                    raise ValueError('EQU can not refer to external symbol')
+                raise ValueError('symbol has not been defined')
+            return Value(value, {} if name in absolute else {None: 1})
+
+        for name in order:
+            instr = equ[name]
+            self.line = instr.line
+            try:
+                value = expressions[name].evaluate(resolve, instr.location)
+            except ValueError as e:
+                self.__error(instr.line, str(e), expressions[name].text)
+                value = Value(0, {})
+            # EQU has no external term, only section start may be left
+            relocation = value.terms.get(None, 0)
+            if relocation != 0 and relocation != 1:
+                self.__error(instr.line, 'invalid relocatable expression', expressions[name].text)
+            symbol_table[name] = value.value
+            if relocation == 0:
+                absolute.add(name)
+
+    # exported definition wins over local one, otherwise the first definition is kept
+    def __index_section(self, block) -> None:
+        index = self.symbol_index
+        extdef = self.__extdef_table[block]
+        absolute = self.__absolute_table[block]
+        for name, value in self.__symbol_table[block].items():
+            # skip literal
+            if name[0] == '=':
                 continue
-            # update program block
-            elif instr['mnemonic'] == 'START':
-                cur_block = instr['symbol']
-                cur_modified_list = []
-            elif instr['mnemonic'] == 'END':
-                self.__modified_record[cur_block] = cur_modified_list.copy()
-                cur_modified_list.clear()
-            elif instr['mnemonic'] == 'CSECT':
-                # update program block M records
-                self.__modified_record[cur_block] = cur_modified_list.copy()
-                cur_modified_list.clear()
-                cur_block = instr['symbol']
-            # update B register content
-            elif instr['mnemonic'] == 'BASE':
-                b_loc = self.__symbol_table[cur_block][instr['operand']]
-            # literal instruction
-            elif instr['mnemonic'][0] == '=':
-                data = list(instr['mnemonic'][3:].split('\''))[0]
-                if instr['mnemonic'][1] == 'C':
-                    opcode = []
-                    for c in data:
-                        opcode.append(ord(c))
-                    instr['opcode'] = opcode
-                elif instr['mnemonic'][1] == 'X':
-                    opcode = []
-                    for i in range(0, len(data), 2):
-                        opcode.append(int(data[i : i + 2], base=16))
-                    instr['opcode'] = opcode
-            elif instr['mnemonic'] == 'WORD':
-                if '-' in instr['operand']:
-                    symbol_1, symbol_2 = instr['operand'].split('-')
-                    location_1 = self.__symbol_table[cur_block][symbol_1] \
-                        if symbol_1 in self.__symbol_table[cur_block] else 0
-                    if location_1 == 0:
-                        cur_modified_list.append({
-                            'location': instr['location'],
-                            'byte': 6,
-                            'offset': '+' + symbol_1,
-                        })
-                    location_2 = self.__symbol_table[cur_block][symbol_2] \
-                        if symbol_2 in self.__symbol_table[cur_block] else 0
-                    if location_2 == 0:
-                        cur_modified_list.append({
-                            'location': instr['location'],
-                            'byte': 6,
-                            'offset': '-' + symbol_2,
-                        })
-                    instr['opcode'] = [
-                        ((location_1 - location_2) & (0xff << i)) >> i
-                        for i in range(16, -1, -8)
-                    ]
-                elif '+' in instr['operand']:
-                    symbol_1, symbol_2 = instr['operand'].split('+')
-                    location_1 = self.__symbol_table[cur_block][symbol_1] \
-                        if symbol_1 in self.__symbol_table[cur_block] else 0
-                    if location_1 == 0:
-                        cur_modified_list.append({
-                            'location': instr['location'],
-                            'byte': 6,
-                            'offset': '+' + symbol_1,
-                        })
-                    location_2 = self.__symbol_table[cur_block][symbol_2] \
-                        if symbol_2 in self.__symbol_table[cur_block] else 0
-                    if location_2 == 0:
-                        cur_modified_list.append({
-                            'location': instr['location'],
-                            'byte': 6,
-                            'offset': '+' + symbol_2,
-                        })
-                    instr['opcode'] = [
-                        ((location_1 + location_2) & (0xff << i)) >> i
-                        for i in range(16, -1, -8)
-                    ]
+            # control section name is external without EXTDEF
+            exported = name in extdef or name == block
+            symbol = index.get(name)
+            if symbol is None:
+                index[name] = Symbol(block, value, name not in absolute, exported, ())
+            elif symbol.section is None or (exported and not symbol.extdef):
+                index[name] = Symbol(block, value, name not in absolute, exported, symbol.extref)
+        for name in self.__extref_table[block]:
+            symbol = index.get(name)
+            if symbol is None:
+                index[name] = Symbol(None, None, True, False, (block,))
+            else:
+                index[name] = symbol._replace(extref=symbol.extref + (block,))
+
+    # EXTREF symbols not exported by any control section of this program
+    def unresolved_externals(self) -> List[str]:
+        return [name for name, symbol in self.symbol_index.items() if symbol.extref and not symbol.extdef]
+
+    # mnemonic -> encoder, built once per opcode table
+    __encoder_tables = {}
+
+    @classmethod
+    def __get_encoder_table(cls, opcode_table) -> dict:
+        table = cls.__encoder_tables.get(opcode_table.digest)
+        if table is not None:
+            return table
+
+        # these has processed in pass one, skip
+        table = dict.fromkeys(['EXTDEF', 'RESW', 'RESB', 'LTORG', 'EQU'])
+        table.update({
+            'START': cls.__encode_start,
+            'EXTREF': cls.__encode_extref,
+            'CSECT': cls.__encode_csect,
+            'END': cls.__encode_end,
+            'BASE': cls.__encode_base,
+            'BYTE': cls.__encode_byte,
+            'WORD': cls.__encode_word,
+        })
+        for mnemonic, opcode in opcode_table.opcode.items():
+            if opcode.format[0] == 1:
+                table[mnemonic] = cls.__encode_format1
+            elif opcode.format[0] == 2:
+                table[mnemonic] = cls.__encode_format2
+            else:
+                table[mnemonic] = cls.__encode_format34
+                table['+' + mnemonic] = cls.__encode_format34
+
+        cls.__encoder_tables[opcode_table.digest] = table
+        return table
+
+    # convert C'...' or X'...' content into bytes
+    @staticmethod
+    def __gen_data_list(kind, data) -> list:
+        if kind == 'C':
+            return [ord(c) for c in data]
+        elif kind == 'X':
+            return list(bytes.fromhex(data))
+        return None
+
+    # literal refers to the first pool placed after it
+    def __get_literal_location(self, instr, literal) -> Optional[int]:
+        pools = self.__cur_literals.get(literal)
+        if not pools:
+            return None
+        return pools[min(bisect_right(pools, instr.location), len(pools) - 1)]
+
+    # PC relative first, then BASE relative
+    def __gen_relative_code_list(self, instr, mnemonic, type, format_num, symbol_loc) -> list:
+        offset = symbol_loc - instr.location - 3
+        # format 3 (PC)
+        if offset >= -2048 and offset <= 2047:
+            return self.__gen_code_list(mnemonic, type, format_num | 2, offset)
+        # format 3 (B)
+        if self.__b_loc is not None:
+            offset = symbol_loc - self.__b_loc
+            if offset >= 0 and offset <= 4095:
+                return self.__gen_code_list(mnemonic, type, format_num | 4, offset)
+        raise SyntaxError(f'line {instr.line}: displacement out of range, use format 4')
+
+    # symbol of current section, EXTREF symbol is 0 and fixed by loader
+    def __resolve_symbol(self, name) -> Value:
+        value = self.__cur_symbols.get(name)
+        if value is not None:
+            return Value(value, {} if name in self.__cur_absolute else {None: 1})
+        if name in self.__cur_extref:
+            return Value(0, {name: 1})
+        raise ValueError('symbol has not been defined')
+
+    # format 4 address of local relocatable symbol is fixed by loader with section start
+    def __add_section_record(self, instr) -> None:
+        self.__cur_modified_list.append({
+            'location': instr.location + 1,
+            'byte': 5,
+            'offset': '+' + self.__cur_block,
+        })
+
+    # symbol not in current section is resolved by loader only if it is EXTREF
+    def __check_extref(self, instr, symbol) -> None:
+        if symbol not in self.__cur_extref:
+            raise SyntaxError(f'line {instr.line}: symbol has not been defined')
+
+    # update program block
+    def __encode_start(self, instr) -> None:
+        self.__cur_block = instr.symbol
+        self.__cur_symbols = self.__symbol_table[instr.symbol]
+        self.__cur_literals = self.__literal_pool.get(instr.symbol, {})
+        self.__cur_absolute = self.__absolute_table.get(instr.symbol, ())
+        self.__cur_extref = set()
+        self.__cur_modified_list = []
+
+    def __encode_csect(self, instr) -> None:
+        # update program block M records
+        if self.__cur_block is not None:
+            self.__modified_record[self.__cur_block] = self.__cur_modified_list
+        self.__encode_start(instr)
+
+    def __encode_end(self, instr) -> None:
+        self.__modified_record[self.__cur_block] = self.__cur_modified_list
+        self.__cur_block = None
+
+    def __encode_extref(self, instr) -> None:
+        self.__cur_extref.update(instr.operand)
+
+    # update B register content
+    def __encode_base(self, instr) -> None:
+        self.__b_loc = self.__cur_symbols.get(instr.operand)
+        if self.__b_loc is None:
+            raise SyntaxError(f'line {instr.line}: symbol has not been defined')
+
+    # literal instruction
+    def __encode_literal(self, instr) -> None:
+        data = instr.mnemonic[3:].split('\'')[0]
+        instr.opcode = self.__gen_data_list(instr.mnemonic[1], data)
+
+    def __encode_byte(self, instr) -> None:
+        data = instr.operand[2:].split('\'')[0]
+        instr.opcode = self.__gen_data_list(instr.operand[0], data)
+
+    def __encode_word(self, instr) -> None:
+        try:
+            value = self.__compile(instr).evaluate(self.__resolve_symbol, instr.location)
+        except ValueError as e:
+            raise SyntaxError(f'line {instr.line}: {e}')
+        # relocation terms left are fixed by loader, section start for local symbols
+        for name, coefficient in value.terms.items():
+            if coefficient != 1 and coefficient != -1:
+                raise SyntaxError(f'line {instr.line}: invalid relocatable expression')
+            self.__cur_modified_list.append({
+                'location': instr.location,
+                'byte': 6,
+                'offset': ('+' if coefficient > 0 else '-') + (self.__cur_block if name is None else name),
+            })
+        value = value.value
+        instr.opcode = [(value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff]
+
+    def __encode_format1(self, instr) -> None:
+        instr.opcode = [self.__opcode[instr.mnemonic].code]
+
+    def __encode_format2(self, instr) -> None:
+        operand = instr.operand if isinstance(instr.operand, list) else [instr.operand]
+        if instr.mnemonic == 'SVC':
+            fields = [int(operand[0]), 0]
+        elif instr.mnemonic == 'SHIFTL' or instr.mnemonic == 'SHIFTR':
+            fields = [REGISTER_CODE.get(operand[0]), int(operand[-1]) - 1]
+        else:
+            fields = [REGISTER_CODE.get(register) for register in operand] + [0]
+        if None in fields or len(operand) > 2:
+            raise SyntaxError(f'line {instr.line}: invalid register')
+        instr.opcode = [
+            self.__opcode[instr.mnemonic].code,
+            fields[0] << 4 | fields[1],
+        ]
+
+    def __encode_format34(self, instr) -> None:
+        mnemonic = instr.mnemonic
+        operand = instr.operand
+        extended = mnemonic[0] == '+'   # format 4
+        if extended:
+            mnemonic = mnemonic[1:]
+
+        # no operand, e.g. RSUB
+        if operand is None:
+            if mnemonic != 'RSUB':
+                raise SyntaxError(f'line {instr.line}: {mnemonic} must have operand')
+            instr.opcode = self.__gen_code_list(mnemonic, 3, 1 if extended else 0, 0)
+        # immediate format (n: 0, i: 1)
+        elif operand[0] == '#':
+            token = operand[1:]
+            symbol_loc = self.__cur_symbols.get(token)
+            # operand is relocatable symbol
+            if symbol_loc is not None and token not in self.__cur_absolute:
+                if extended:
+                    instr.opcode = self.__gen_code_list(mnemonic, 1, 1, symbol_loc)
+                    self.__add_section_record(instr)
+                else:
+                    instr.opcode = self.__gen_relative_code_list(instr, mnemonic, 1, 0, symbol_loc)
+            # operand is number or absolute symbol
+            elif symbol_loc is not None or token.isdigit():
+                # this does not memory, so do not consider PC and B
+                offset = int(token) if symbol_loc is None else symbol_loc
+                if extended:
+                    instr.opcode = self.__gen_code_list(mnemonic, 1, 1, offset)
+                elif offset <= 4095:
+                    instr.opcode = self.__gen_code_list(mnemonic, 1, 0, offset)
                 else:
-                    data = list(instr['operand'][2:].split('\''))[0]
-                    if instr['mnemonic'][0] == 'C':
-                        opcode = []
-                        for c in data:
-                            opcode.append(ord(c))
-                        instr['opcode'] = opcode
-                    elif instr['mnemonic'][0] == 'X':
-                        opcode = []
-                        for i in range(0, len(data), 2):
-                            opcode.append(int(data[i : i + 2], base=16))
-                        instr['opcode'] = opcode
-            elif instr['mnemonic'] == 'BYTE':
-                data = list(instr['operand'][2:].split('\''))[0]
-                if instr['operand'][0] == 'C':
-                    opcode = []
-                    for c in data:
-                        opcode.append(ord(c))
-                    instr['opcode'] = opcode
-                elif instr['operand'][0] == 'X':
-                    opcode = []
-                    for i in range(0, len(data), 2):
-                        opcode.append(int(data[i : i + 2], base=16))
-                    instr['opcode'] = opcode
+                    raise SyntaxError(f'line {instr.line}: immediate value out of range, use format 4')
             else:
-                # register coresponding code
-                register_cord = {'A': 0, 'X': 1, 'L': 2, 'B': 3, 'S': 4, 'T': 5, 'F': 6,}
-                # format 2
-                format2_list = ['ADDR', 'CLEAR', 'COMPR', 'DIVR', 'MULR', 'RMO' 'SHIFTL', 'SHIFTR', 'SVC', 'TIXR']
-                for mnemonic in format2_list:
-                    if instr['mnemonic'] == mnemonic:
-                        if len(instr['operand']) == 2:
-                            instr['opcode'] = [
-                                self.__opcode[mnemonic]['code'],
-                                register_cord[instr['operand'][0]] << 4 | register_cord[instr['operand'][1]]
-                            ]
-                        elif len(instr['operand']) == 1:
-                            instr['opcode'] = [
-                                self.__opcode[mnemonic]['code'],
-                                register_cord[instr['operand'][0]] << 4
-                            ]
-                if 'opcode' in instr:
-                    continue
-                elif instr['mnemonic'] == 'RSUB':
-                    instr['opcode'] = self.__gen_code_list('RSUB', 3, 0, 0)
+                raise SyntaxError(f'line {instr.line}: symbol has not been defined')
+        # indirect format (n: 1, i: 0)
+        elif operand[0] == '@':
+            symbol_loc = self.__cur_symbols.get(operand[1:])
+            # symbol not defined
+            if symbol_loc is None:
+                raise SyntaxError(f'line {instr.line}: symbol has not been defined')
+            elif extended:
+                instr.opcode = self.__gen_code_list(mnemonic, 2, 1, symbol_loc)
+                if operand[1:] not in self.__cur_absolute:
+                    self.__add_section_record(instr)
+            else:
+                instr.opcode = self.__gen_relative_code_list(instr, mnemonic, 2, 0, symbol_loc)
+        # direct format (n: 1, i: 1)
+        else:
+            format_num = 0  # x, b, p, e
+            # x label
+            if isinstance(operand, list) and 'X' in operand:
+                format_num |= 8
+            # get first element
+            first_element = operand[0] if isinstance(operand, list) else operand
+            if first_element[0] == '=':
+                symbol_loc = self.__get_literal_location(instr, first_element)
+            else:
+                symbol_loc = self.__cur_symbols.get(first_element)
+            if extended:
+                format_num |= 1
+                # symbol nodefined (EXTREF)
+                if symbol_loc is None:
+                    self.__check_extref(instr, first_element)
+                    # by default, EXTREF memory reference is 0
+                    instr.opcode = self.__gen_code_list(mnemonic, 3, format_num, 0)
+                    self.__cur_modified_list.append({
+                        'location': instr.location + 1,
+                        'byte': 5,
+                        'offset': '+' + first_element,
+                    })
                 else:
-                    # immediate format (n: 0, i: 1)
-                    if instr['operand'][0] == '#':
-                        token = instr['operand'][1:]
-                        # operand is symbol
-                        if token in self.__symbol_table[cur_block]:
-                            symbol_loc = self.__symbol_table[cur_block][token]
-                            offset = symbol_loc - instr['location'] - 3
-                            # format 3 (PC)
-                            if offset >= -2048 and offset <= 2047:
-                                instr['opcode'] = self.__gen_code_list(instr['mnemonic'], 1, 2, offset)
-                            else:
-                                offset = symbol_loc - b_loc
-                                # format 3 (B)
-                                if offset >= 0 and offset <= 4095:
-                                    instr['opcode'] = self.__gen_code_list(instr['mnemonic'], 1, 4, offset)
-                                # format 4
-                                else:
-                                    instr['opcode'] = self.__gen_code_list(instr['mnemonic'][1:], 1, 1, symbol_loc)
-                        # operand is number
-                        else:
-                            # this does not memory, so do not consider PC and B
-                            offset = int(token)
-                            # format 4
-                            if offset > 4095:
-                                instr['opcode'] = self.__gen_code_list(instr['mnemonic'][1:], 1, 1, offset)
-                            # format 3
-                            else:
-                                instr['opcode'] = self.__gen_code_list(instr['mnemonic'], 1, 0, offset)
-                    # indirect format (n: 1, i: 0)
-                    elif instr['operand'][0] == '@':
-                        symbol = instr['operand'][1:]
-                        symbol_loc = self.__symbol_table[cur_block][symbol] \
-                            if symbol in self.__symbol_table[cur_block] else None
-                        # symbol not defined
-                        if symbol_loc == None:
-                            raise SyntaxError(f'line {index + 1}: symbol has not been defined')
-                        else:
-                            # calculate offset
-                            offset = symbol_loc - instr['location'] - 3
-                            # format 3 (PC)
-                            if offset >= -2048 and offset <= 2047:
-                                instr['opcode'] = self.__gen_code_list(instr['mnemonic'], 2, 2, offset)
-                            else:
-                                offset = symbol_loc - b_loc
-                                # format 3 (B)
-                                if offset >= 0 and offset <= 4095:
-                                    instr['opcode'] = self.__gen_code_list(instr['mnemonic'], 2, 4, offset)
-                                # format 4
-                                else:
-                                    instr['opcode'] = self.__gen_code_list(instr['mnemonic'], 2, 1, symbol_loc)
-                    # direct format (n: 1, i: 1)
-                    else:
-                        format_num = 0  # x, b, p, e
-                        # x label
-                        if isinstance(instr['operand'], list) and 'X' in instr['operand']:
-                            format_num |= 8
-                        # format 4
-                        if instr['mnemonic'][0] == '+':
-                            format_num |= 1
-                            symbol_loc = None
-                            mnemonic = instr['mnemonic'][1:]
-                            # get first element
-                            first_element = instr['operand'][0] if isinstance(instr['operand'], list) else instr['operand']
-                            # get symbol location
-                            try:
-                                symbol_loc = self.__symbol_table[cur_block][first_element]
-                            except:
-                                symbol_loc = None
-                            # symbol nodefined (EXTREF)
-                            if symbol_loc == None:
-                                # by default, EXTREF memory reference is 0
-                                instr['opcode'] = self.__gen_code_list(mnemonic, 3, format_num, 0)
-                                cur_modified_list.append({
-                                    'location': instr['location'] + 1,
-                                    'byte': 5,
-                                    'offset': '+' + first_element,
-                                })
-                            else:
-                                instr['opcode'] = self.__gen_code_list(mnemonic, 3, format_num, symbol_loc)
-                        else:
-                            symbol_loc = None
-                            # get first element
-                            first_element = instr['operand'][0] if isinstance(instr['operand'], list) else instr['operand']
-                            # get symbol location
-                            try:
-                                symbol_loc = self.__symbol_table[cur_block][first_element]
-                            except:
-                                symbol_loc = None
-                            # symbol nodefined (EXTREF)
-                            if symbol_loc == None:
-                                # by default, EXTREF memory reference is 0
-                                instr['opcode'] = self.__gen_code_list(instr['mnemonic'], 3, format_num, 0)
-                            else:
-                                offset = symbol_loc - instr['location'] - 3
-                                # format 3 (PC)
-                                if offset >= -2048 and offset <= 2047:
-                                    format_num |= 2
-                                    instr['opcode'] = self.__gen_code_list(instr['mnemonic'], 3, format_num, offset)
-                                # format 3 (B)
-                                else:
-                                    format_num |= 4
-                                    offset = symbol_loc - b_loc
-                                    instr['opcode'] = self.__gen_code_list(instr['mnemonic'], 3, format_num, offset)
-        
+                    instr.opcode = self.__gen_code_list(mnemonic, 3, format_num, symbol_loc)
+                    if first_element not in self.__cur_absolute:
+                        self.__add_section_record(instr)
+            # symbol nodefined (EXTREF)
+            elif symbol_loc is None:
+                self.__check_extref(instr, first_element)
+                # by default, EXTREF memory reference is 0
+                instr.opcode = self.__gen_code_list(mnemonic, 3, format_num, 0)
+            else:
+                instr.opcode = self.__gen_relative_code_list(instr, mnemonic, 3, format_num, symbol_loc)
+
+    # pass two
+    def pass_two(self) -> None:
+        self.__b_loc = None             # rocord register BASE
+        if self.jobs > 1 and len(self.instruction) >= self.PARALLEL_THRESHOLD:
+            sections = self.__split_sections()
+            # every section must start with START or CSECT to be encoded alone
+            if len(sections) > 1 and sections[0][0].mnemonic == 'START':
+                self.__pass_two_parallel(sections)
+                return
+        self.__pass_two(self.instruction)
+
+    # pass two of a single control section, BASE value carries from previous section
+    def encode_section(self, instructions, symbol_table, literal_pool, absolute, b_loc) -> tuple:
+        block = instructions[0].symbol
+        self.__symbol_table[block] = symbol_table
+        self.__literal_pool[block] = literal_pool
+        self.__absolute_table[block] = absolute
+        self.__b_loc = b_loc
+        self.__pass_two(instructions)
+        opcodes = [bytes(instr.opcode) if instr.opcode is not None else None for instr in instructions]
+        return opcodes, self.__modified_record[block]
+
+    # encode control sections on a process pool, merge results in source order
+    def __pass_two_parallel(self, sections) -> None:
+        # BASE value at the beginning of every section
+        b_loc = None
+        entry_base = []
+        for section in sections:
+            entry_base.append(b_loc)
+            symbol_table = self.__symbol_table[section[0].symbol]
+            for instr in section:
+                if instr.mnemonic == 'BASE':
+                    b_loc = symbol_table.get(instr.operand)
+
+        # forked workers inherit the sections, only their index is sent
+        global _shared_sections
+        if 'fork' in multiprocessing.get_all_start_methods():
+            _shared_sections = sections
+            context = multiprocessing.get_context('fork')
+            jobs = range(len(sections))
+        else:
+            context = None
+            jobs = sections
+
+        encode = partial(encode_section, self.opcode_table.path)
+        try:
+            with ProcessPoolExecutor(min(self.jobs, len(sections)), mp_context=context) as executor:
+                results = executor.map(
+                    encode,
+                    [self.__symbol_table[section[0].symbol] for section in sections],
+                    [self.__literal_pool[section[0].symbol] for section in sections],
+                    [self.__absolute_table[section[0].symbol] for section in sections],
+                    entry_base,
+                    jobs,
+                )
+                for section, (opcodes, modified) in zip(sections, results):
+                    for instr, opcode in zip(section, opcodes):
+                        if opcode is not None:
+                            instr.opcode = list(opcode)
+                    self.__modified_record[section[0].symbol] = modified
+        finally:
+            _shared_sections = None
+
+    # pass two over whole program or a run of control sections, BASE carries over
+    def __pass_two(self, instructions) -> None:
+        self.__cur_block = None         # specify current program block
+        self.__cur_symbols = {}         # current program block symbol table
+        self.__cur_extref = set()       # current program block EXTREF symbols
+        self.__cur_absolute = ()        # current program block absolute symbols
+        self.__cur_modified_list = []   # record current program block M records
+
+        encoder_table = self.__encoder_table
+        for instr in instructions:
+            self.line = instr.line
+            # mnemonic not in table is literal
+            encoder = encoder_table.get(instr.mnemonic, Assembler.__encode_literal)
+            if encoder is not None:
+                encoder(self, instr)
+
+        # instructions end before END, close the last control section
+        if self.__cur_block is not None:
+            self.__modified_record[self.__cur_block] = self.__cur_modified_list
+
     # write file
-    def write_file(self, file_name) -> None:
-        # record program block length and start position
-        cur_block = {}
-        cur_opcode_list = []
-        cur_position_list = []
+    def write_file(self, file_name, format='text') -> List[ObjectSection]:
+        return self.__write_program(file_name, self.__gen_program_info(self.instruction), format)
+
+    # symbol map: definitions of every section, then external references and where they resolve
+    def write_symbol_map(self, file_name) -> None:
+        lines = ['{:<8s} {:<8s} {:<6s} {:<4s} {}'.format('section', 'symbol', 'value', 'type', 'scope')]
+        for block, symbol_table in self.__symbol_table.items():
+            absolute = self.__absolute_table.get(block, ())
+            extdef = self.__extdef_table.get(block, {})
+            for name, value in symbol_table.items():
+                if name[0] == '=':
+                    continue
+                lines.append('{:<8s} {:<8s} {:06X} {:<4s} {}'.format(
+                    block, name, value & 0xffffff,
+                    'A' if name in absolute else 'R',
+                    'CSECT' if name == block else 'EXTDEF' if name in extdef else 'LOCAL',
+                ))
+        lines.append('')
+        lines.append('{:<8s} {:<10s} {}'.format('extref', 'defined', 'referenced by'))
+        for name, symbol in self.symbol_index.items():
+            if symbol.extref:
+                lines.append('{:<8s} {:<10s} {}'.format(
+                    name, symbol.section if symbol.extdef else 'UNRESOLVED', ' '.join(symbol.extref)))
+        with open(file_name, mode='w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    # collect H/D/R/T/M content of whole program or a run of control sections
+    def __gen_program_info(self, instructions) -> dict:
         program_info = {}
-        end_position = ()
-
-        def gen_extref_str(ext_info: list) -> str:
-            ext_str = 'R'
-            for label in ext_info:
-                ext_str += '{:<6s}'.format(label)
-            return ext_str.strip()
-
-        def gen_extdef_str(ext_info: dict) -> str:
-            ext_str = 'D'
-            for label, value in ext_info.items():
-                ext_str += '{:<6s}{:06X}'.format(label, value)
-            return ext_str.strip()
-
-        def gen_modified_list(modified_info: list) -> list:
-            modified_list = []
-            for info in modified_info:
-                modified_str = 'M{:06X}{:02X}{:<7s}'.format(
-                    info['location'], info['byte'], info['offset'])
-                modified_list.append(modified_str.strip())
-            return modified_list
-
-        def gen_block_info(symbol_info: dict) -> dict:
-            block_info = {
-                'name': symbol_info['symbol'],
-                'length': 0,
-                'start': instr['location'],
-            }
-
-            extdef_info = self.__extdef_table[symbol_info['symbol']]
-            if extdef_info:
-                block_info['extdef'] = gen_extdef_str(extdef_info)
-            else:
-                block_info['extdef'] = ''
+        cur_block = None
+        code = bytearray()      # object code of current block, in emitting order
+        text = []               # T records as (location, start, end) of code
+        next_location = None    # location right after last emitted code
 
-            extref_info = self.__extref_table[symbol_info['symbol']]
-            if extref_info:
-                block_info['extref'] = gen_extref_str(extref_info)
-            else:
-                block_info['extref'] = ''
+        for instr in instructions:
+            if instr.mnemonic == 'START' or instr.mnemonic == 'CSECT':
+                cur_block = {
+                    'start': instr.location,
+                    'length': 0,
+                    'extdef': self.__extdef_table[instr.symbol],
+                    'extref': self.__extref_table[instr.symbol],
+                    'modified': self.__modified_record[instr.symbol],
+                    'code': bytearray(),
+                    'text': [],
+                }
+                program_info[instr.symbol] = cur_block
+                code = cur_block['code']
+                text = cur_block['text']
+                next_location = None
+            elif instr.mnemonic == 'END':
+                # END symbol will record start code position
+                cur_block['end'] = instr.operand
+            elif instr.location is not None:
+                length = instr.location
+                if instr.opcode is not None:
+                    length += len(instr.opcode)
+                # trailing RESW/RESB is part of the section
+                elif instr.mnemonic == 'RESW' or instr.mnemonic == 'RESB':
+                    length += self.__size(instr)
+                cur_block['length'] = max(cur_block['length'], length)
 
-            modified_info = self.__modified_record[symbol_info['symbol']]
-            if modified_info:
-                block_info['modified'] = gen_modified_list(modified_info)
+            if instr.opcode is not None:
+                size = len(instr.opcode)
+                # RESW/RESB gap or full record starts new T record
+                if instr.location != next_location or len(code) - text[-1][1] + size > T_RECORD_SIZE:
+                    text.append([instr.location, len(code), len(code)])
+                code += bytes(instr.opcode)
+                text[-1][2] = len(code)
+                next_location = instr.location + size
+
+        return program_info
+
+    # object program of every control section
+    def __gen_sections(self, program_info) -> List[ObjectSection]:
+        # END symbol will record start code position
+        end_position = (None, None)
+        for info in program_info.values():
+            if 'end' in info:
+                symbol = self.symbol_index.get(info['end'])
+                if symbol is not None and symbol.section is not None:
+                    end_position = (symbol.section, symbol.value)
+
+        sections = []
+        for name, info in program_info.items():
+            section = ObjectSection(name, info['start'], info['length'])
+            section.extdef = info['extdef']
+            section.extref = info['extref']
+            section.code = info['code']
+            section.text = info['text']
+            section.modified = [
+                (modified['location'], modified['byte'], modified['offset'])
+                for modified in info['modified']
+            ]
+            if name == end_position[0]:
+                section.entry = end_position[1]
+            sections.append(section)
+        return sections
+
+    def __write_program(self, file_name, program_info, format='text') -> List[ObjectSection]:
+        sections = self.__gen_sections(program_info)
+        write_object(file_name, sections, format)
+        return sections
+
+    # split program into control sections, each starts with START or CSECT
+    def __split_sections(self) -> list:
+        sections = [[]]
+        for instr in self.instruction:
+            if (instr.mnemonic == 'START' or instr.mnemonic == 'CSECT') and sections[-1]:
+                sections.append([])
+            sections[-1].append(instr)
+        return sections
+
+    # assemble section by section, reuse cached sections whose input is unchanged
+    def __assemble_incremental(self, cache) -> dict:
+        program_info = {}
+        self.__b_loc = None
+        self.__reused_sections = 0
+        self.__pool_records = 0
+        if self.auto_literals:
+            self.instruction = self.place_literal_pools(self.instruction)
+        for section in self.__split_sections():
+            # section result also depends on literals and BASE left by previous section
+            key = cache.key(
+                self.opcode_table.digest,
+                tuple(self.__literal_table),
+                self.__b_loc,
+                self.relax,
+                [(instr.symbol, instr.mnemonic, instr.operand) for instr in section],
+            )
+            entry = cache.get(key)
+            if entry is None:
+                section = self.__sized_pass_one(section, self.__b_loc)
+                self.__pass_two(section)
+                section_info = self.__gen_program_info(section)
+                # literal pools are only in the processed section
+                self.__pool_records += sum(instr.symbol == '*' for instr in section)
+                entry = {
+                    'info': section_info,
+                    'symbol': {name: self.__symbol_table[name] for name in section_info},
+                    'literal_pool': {name: self.__literal_pool[name] for name in section_info},
+                    'absolute': {name: self.__absolute_table[name] for name in section_info},
+                    'extdef': {name: self.__extdef_table[name] for name in section_info},
+                    'extref': {name: self.__extref_table[name] for name in section_info},
+                    'modified': {name: self.__modified_record[name] for name in section_info},
+                    'literal': tuple(self.__literal_table),
+                    'base': self.__b_loc,
+                }
+                cache.put(key, entry)
             else:
-                block_info['modified'] = []
+                self.__reused_sections += 1
+                self.__symbol_table.update(entry['symbol'])
+                self.__literal_pool.update(entry['literal_pool'])
+                self.__absolute_table.update(entry['absolute'])
+                self.__extdef_table.update(entry['extdef'])
+                self.__extref_table.update(entry['extref'])
+                self.__modified_record.update(entry['modified'])
+                self.__literal_table = dict.fromkeys(entry['literal'])
+                self.__b_loc = entry['base']
+                for name in entry['info']:
+                    self.__index_section(name)
+            program_info.update(entry['info'])
+        return program_info
 
-            return block_info
+    # run phase, record its wall time and the net count of memory blocks it left allocated
+    # blocks allocated and freed within the phase are not counted
+    def __measure(self, phase, call, *args):
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        result = call(*args)
+        self.stats['phases'][phase] = {
+            'seconds': time.perf_counter() - start,
+            'live_blocks': sys.getallocatedblocks() - blocks,
+        }
+        return result
 
+    # counters of the assembled program
+    def __collect_stats(self, sections) -> None:
+        addressing = dict.fromkeys(['pc_relative', 'base_relative', 'extended', 'absolute'], 0)
+        lines = instructions = literals = 0
         for instr in self.instruction:
-            if instr['mnemonic'] == 'START':
-                cur_opcode_list.clear()
-                cur_position_list.clear()
-                cur_block = gen_block_info(instr)                
-            elif instr['mnemonic'] == 'CSECT':
-                name = cur_block['name']
-                del cur_block['name']
-                program_info[name] = cur_block
-                
-                # merge this block opcode
-                program_info[name]['opcode'] = {}
-                for index, pos in enumerate(cur_position_list):
-                    program_info[name]['opcode'][pos] = cur_opcode_list[index]
-                
-                # define new block info
-                cur_opcode_list.clear()
-                cur_position_list.clear()
-                cur_block = gen_block_info(instr)
-            elif instr['mnemonic'] == 'END':
-                name = cur_block['name']
-                del cur_block['name']
-                program_info[name] = cur_block
-
-                # merge this block opcode
-                program_info[name]['opcode'] = {}
-                for index, pos in enumerate(cur_position_list):
-                    program_info[name]['opcode'][pos] = cur_opcode_list[index]
+            lines = max(lines, instr.line)
+            if instr.symbol == '*':
+                literals += 1
+                continue
+            instructions += 1
+            # RSUB and other instructions without operand have no addressing mode
+            if instr.opcode is None or instr.operand is None:
+                continue
+            opcode = self.__opcode.get(instr.mnemonic.lstrip('+'))
+            if opcode is None or opcode.format[0] != 3:
+                continue
+            # x b p e flags of format 3 and 4
+            flags = instr.opcode[1] >> 4
+            if flags & 1:
+                addressing['extended'] += 1
+            elif flags & 2:
+                addressing['pc_relative'] += 1
+            elif flags & 4:
+                addressing['base_relative'] += 1
+            else:
+                addressing['absolute'] += 1
 
-                # END symbol will record start code position
-                for block in self.__symbol_table.keys():
-                    if instr['operand'] in self.__symbol_table[block]:
-                        end_position = (block, self.__symbol_table[block][instr['operand']])
-            elif 'location' in instr:
-                length = instr['location']
-                if 'opcode' in instr:
-                    length += len(instr['opcode'])
-                cur_block['length'] = max(cur_block['length'], length)
-            if 'opcode' in instr:
-                opcode_str = ''
-                for opc in instr['opcode']:
-                    opcode_str += '{:02X}'.format(opc)
-                instr['opcode'] = opcode_str
-
-                if len(cur_opcode_list):
-                    if len(cur_opcode_list[-1]) + len(opcode_str) // 2 > 60:
-                        cur_position_list.append(instr['location'])
-                        cur_opcode_list.append(opcode_str)
-                    else:
-                        cur_opcode_list[-1] += opcode_str
+        self.stats.update({
+            'lines': lines,
+            'instructions': instructions,
+            # incremental mode places literal pools in section copies
+            'literals': literals + self.__pool_records,
+            'addressing': addressing,
+            'sections': {
+                section.name: {
+                    'symbols': sum(name[0] != '=' for name in self.__symbol_table.get(section.name, ())),
+                    't_records': sum(-(-(end - start) // T_RECORD_SIZE) for _, start, end in section.text),
+                    'm_records': len(section.modified),
+                } for section in sections
+            },
+        })
+        self.stats['t_records'] = sum(section['t_records'] for section in self.stats['sections'].values())
+        self.stats['m_records'] = sum(section['m_records'] for section in self.stats['sections'].values())
+        self.stats['unresolved_externals'] = len(self.unresolved_externals())
+        if self.__reused_sections is not None:
+            self.stats['reused_sections'] = self.__reused_sections
+        if self.literal_report is not None:
+            self.stats.update(self.literal_report)
+        if self.relax:
+            self.stats['relaxed_format4'] = self.__relaxed
+            self.stats['relax_rounds'] = self.__relax_rounds
+
+    def execute(self, read_file, write_file, cache=None, format='text') -> None:
+        self.reset()
+        measure = self.__get_measure()
+
+        measure('read_file', self.read_file, read_file)
+        if cache is None:
+            measure('pass_one', self.pass_one)
+            measure('pass_two', self.pass_two)
+            sections = measure('write_file', self.write_file, write_file, format)
+        else:
+            program_info = measure('incremental', self.__assemble_incremental, cache)
+            sections = measure('write_file', self.__write_program, write_file, program_info, format)
+            cache.evict()
+
+        if self.stats is not None:
+            self.__collect_stats(sections)
+
+    # statistics only wrap the phases, nothing is counted when disabled
+    def __get_measure(self):
+        if self.stats is not None:
+            return self.__measure
+        return lambda phase, call, *args: call(*args)
+
+    # assemble source text or lines in memory, no file is read or written
+    #   file_name : file the source was read from, INCLUDE is relative to it
+    def assemble(self, source: Union[str, bytes, Iterable[str]], file_name=None) -> 'ObjectProgram':
+        self.reset()
+        measure = self.__get_measure()
+        if isinstance(source, bytes):
+            source = source.decode()
+        if isinstance(source, str):
+            source = source.splitlines()
+
+        measure('read_source', self.read_source, source, file_name)
+        measure('pass_one', self.pass_one)
+        measure('pass_two', self.pass_two)
+        sections = measure('build', self.build_sections)
+        if self.stats is not None:
+            self.__collect_stats(sections)
+        return ObjectProgram(sections, self.symbol_index, self.__symbol_table)
+
+    # object program of the assembled source
+    def build_sections(self) -> List[ObjectSection]:
+        return self.__gen_sections(self.__gen_program_info(self.instruction))
+
+    # lex, pass one and resolve every operand without encoding, return all errors and warnings
+    #   file_name : source the lines come from, INCLUDE is relative to it
+    def check(self, lines, file_name=None) -> List[Diagnostic]:
+        self.reset()
+        measure = self.__get_measure()
+        self.__diagnostics = diagnostics = []
+        self.__source_lines = [line.rstrip('\r\n') for line in lines]
+        try:
+            measure('read_source', self.__check_source, file_name)
+            measure('pass_one', self.pass_one)
+            measure('resolve', self.__check_program, self.instruction)
+        except (SyntaxError, ValueError, KeyError) as e:
+            # pass one can not go on, what was found so far is reported
+            self.__keep_error(e)
+        finally:
+            self.__diagnostics = None
+        # relaxation runs pass one again, a problem is reported once
+        return sorted(dict.fromkeys(diagnostics), key=lambda diagnostic: (diagnostic.line, diagnostic.column))
+
+    # parse every line, a line with error is left out
+    def __check_source(self, file_name) -> None:
+        tokens = None
+        try:
+            for line_no, tokens in self.__source_tokens(self.__source_lines, file_name):
+                try:
+                    self.instruction.append(self.__parse_tokens(line_no, tokens))
+                except SyntaxError as e:
+                    self.__keep_error(e, tokens[0])
+        except SyntaxError as e:
+            # macro or include error ends the stream
+            self.__keep_error(e)
+
+    # operands of every instruction against the symbol tables of pass one
+    def __check_program(self, program) -> None:
+        self.__b_loc = None
+        self.__cur_block = None
+        self.__cur_symbols = {}
+        self.__cur_extref = set()
+        self.__cur_absolute = ()
+        self.__cur_modified_list = []
+
+        extref_lines = {}   # (section, symbol) -> line of its EXTREF
+        encoder_table = self.__encoder_table
+        started = False     # START after the first is reported by pass one
+        for instr in program:
+            self.line = instr.line
+            if instr.mnemonic == 'START':
+                if started:
+                    continue
+                started = True
+            operand = instr.operand[0] if isinstance(instr.operand, list) else instr.operand
+            try:
+                if instr.symbol != '*' and instr.mnemonic.lstrip('+') in self.__opcode \
+                        and self.__opcode[instr.mnemonic.lstrip('+')].format[0] == 3:
+                    self.__check_format34(instr, operand)
                 else:
-                    cur_position_list.append(instr['location'])
-                    cur_opcode_list.append(opcode_str)
-
-        with open(file_name, mode = 'w') as f:
-            for symbol, info in program_info.items():
-                # header
-                f.write('H{:<6s}{:06X}{:06X}\n'.format(
-                    symbol, info['start'], info['length']
-                ))
+                    # directives, format 1 and 2 are cheap to encode
+                    encoder = encoder_table.get(instr.mnemonic, Assembler.__encode_literal)
+                    if encoder is not None:
+                        encoder(self, instr)
+            except SyntaxError as e:
+                self.__keep_error(e, operand)
+
+            if instr.mnemonic == 'EXTDEF':
+                for name in instr.operand:
+                    if self.__extdef_table[self.__cur_block].get(name) is None:
+                        self.__error(instr.line, f'EXTDEF symbol {name} has not been defined', name)
+            elif instr.mnemonic == 'EXTREF':
+                for name in instr.operand:
+                    extref_lines[(self.__cur_block, name)] = instr.line
 
-                # external define
-                if info['extdef']:
-                    f.write(info['extdef'] + '\n')
-                
-                # external reference
-                if info['extref']:
-                    f.write(info['extref'] + '\n')
-                
-                # opcode
-                for offset, content in info['opcode'].items():
-                    f.write('T{:06X}{:02X}{}\n'.format(offset, len(content) // 2, content))
-
-                # modified record
-                for modified in info['modified']:
-                    f.write(modified + '\n')
-
-                # END record
-                if symbol == end_position[0]:
-                    f.write('E{:06X}\n'.format(end_position[1]))
+        # may still be defined by another object program
+        for name in self.unresolved_externals():
+            for block in self.symbol_index[name].extref:
+                self.__error(extref_lines.get((block, name), 1),
+                             f'external symbol {name} is not defined by any control section', name, 'warning')
+
+    # format 3/4 operand: defined, and in reach of PC or BASE when format 3
+    def __check_format34(self, instr, operand) -> None:
+        if operand is None:
+            if instr.mnemonic.lstrip('+') != 'RSUB':
+                self.__error(instr.line, f'{instr.mnemonic.lstrip("+")} must have operand', instr.mnemonic)
+            return
+        extended = instr.mnemonic[0] == '+'
+        if operand[0] == '#':
+            token = operand[1:]
+            target = int(token) if token.isdigit() else self.__cur_symbols.get(token)
+            if target is None:
+                self.__error(instr.line, f'symbol {token} has not been defined', token)
+                return
+            if token.isdigit() or token in self.__cur_absolute:
+                if not extended and target > 4095:
+                    self.__error(instr.line, 'immediate value out of range, use format 4', token)
+                return
+        elif operand[0] == '@':
+            token = operand[1:]
+            target = self.__cur_symbols.get(token)
+            if target is None:
+                self.__error(instr.line, f'symbol {token} has not been defined', token)
+                return
+        elif operand[0] == '=':
+            token = operand
+            target = self.__get_literal_location(instr, operand)
+            if target is None:
+                self.__error(instr.line, f'literal {operand} is not placed in this section', operand)
+                return
+        else:
+            token = operand
+            target = self.__cur_symbols.get(token)
+            if target is None:
+                if token not in self.__cur_extref:
+                    self.__error(instr.line, f'symbol {token} has not been defined', token)
+                elif not extended:
+                    self.__error(instr.line, f'external symbol {token} in format 3 is not relocated, use format 4',
+                                 token, 'warning')
+                return
+
+        if extended:
+            return
+        offset = target - instr.location - 3
+        if -2048 <= offset <= 2047:
+            return
+        if self.__b_loc is None:
+            self.__error(instr.line, 'displacement out of PC relative range and no BASE, use BASE or format 4', token)
+        elif not 0 <= target - self.__b_loc <= 4095:
+            self.__error(instr.line, 'displacement out of PC and BASE relative range, use format 4', token)
+
+    # one pass mode: encode while reading, code waiting for a symbol is patched when it is defined
+    def execute_one_pass(self, read_file, write_file) -> None:
+        self.reset()
+        try:
+            with open(write_file, mode='w+b') as f:
+                self.__stream = TextStream(f)
+                instructions = (
+                    self.__parse_tokens(line_no, tokens)
+                    for line_no, tokens in self.__source_tokens(read_lines(read_file), read_file)
+                )
+                if self.stats is not None:
+                    self.__measure('one_pass', self.__one_pass, instructions)
                 else:
-                    f.write('E\n')
-                
-                f.write('\n')
+                    self.__one_pass(instructions)
+        except BaseException:
+            # do not leave half written object program
+            if os.path.exists(write_file):
+                os.remove(write_file)
+            raise
 
-    def execute(self, read_file, write_file) -> None:
-        self.read_file(read_file)
-        self.pass_one()
-        self.pass_two()
-        self.write_file(write_file)
+    # only unresolved instructions, symbol tables and M records are kept
+    def __one_pass(self, instructions) -> None:
+        self.__cur_block = None
+        self.__b_loc = None
+        self.__base_symbol = None   # BASE operand not defined yet
+        self.__first_block = None   # section of START, its E record waits for END
 
-OPTION_CONFIG = ['-o', '-a']
+        for instr in instructions:
+            self.line = instr.line
+            mnemonic = instr.mnemonic
+            if mnemonic == 'START' or mnemonic == 'CSECT':
+                if self.__cur_block is not None:
+                    self.__end_one_pass_section(hold_entry=self.__cur_block == self.__first_block)
+                if mnemonic == 'START':
+                    self.__literal_table.clear()
+                    self.symbol_index.clear()
+                    self.__first_block = instr.symbol
+                self.__begin_one_pass_section(instr)
+            elif self.__cur_block is None:
+                raise SyntaxError(f'line {instr.line}: instruction out of control section')
+            elif mnemonic in EXTERNAL_DIRECTIVES:
+                # header is written with the first code
+                if self.__stream.started:
+                    raise SyntaxError(f'line {instr.line}: {mnemonic} must be before code in one pass mode')
+                if mnemonic == 'EXTDEF':
+                    self.__extdef_table[self.__cur_block].update(dict.fromkeys(instr.operand))
+                else:
+                    self.__extref_table[self.__cur_block].extend(instr.operand)
+                    self.__cur_extref.update(instr.operand)
+            elif mnemonic == 'RESW' or mnemonic == 'RESB':
+                instr.location = self.__location
+                if instr.symbol is not None:
+                    self.__define(instr.symbol, instr.location)
+                self.__location += int(instr.operand) * (3 if mnemonic == 'RESW' else 1)
+                self.__one_pass_length(self.__location)
+            elif mnemonic == 'LTORG' or mnemonic == 'END':
+                self.__place_literal_pool(instr)
+                if mnemonic == 'END':
+                    self.__end_one_pass_program(instr)
+            elif mnemonic == 'EQU':
+                # value of '*' in expression
+                instr.location = self.__location
+                self.__one_pass_length(instr.location)
+                waiting = [name for name in self.__compile(instr).symbols if name not in self.__cur_symbols]
+                if waiting:
+                    fixup = [instr, len(waiting), None]
+                    for name in waiting:
+                        self.__fixups.setdefault(name, []).append(fixup)
+                else:
+                    self.__define(*self.__one_pass_equ(instr))
+            elif mnemonic == 'BASE':
+                self.__b_loc = self.__cur_symbols.get(instr.operand)
+                self.__base_symbol = instr.operand if self.__b_loc is None else None
+                self.__base_line = instr.line
+            else:
+                self.__one_pass_instruction(instr)
 
-if __name__ == "__main__":
-    # initial class
-    asm = Assembler()
-    # get options
-    sorted_opt = []
-    temp_opt = None
-    # sort and classify option
-    for opt in sys.argv[1:]:
-        if temp_opt != None:
-            sorted_opt = [temp_opt, opt] + sorted_opt
-            temp_opt = None
-        elif opt in OPTION_CONFIG:
-            temp_opt = opt
+        if self.__cur_block is not None:
+            self.__end_one_pass_section()
+
+    def __begin_one_pass_section(self, instr) -> None:
+        block = instr.symbol
+        self.__cur_block = block
+        self.__cur_symbols = {}
+        self.__cur_absolute = set()
+        self.__cur_extref = set()
+        self.__cur_literals = {}
+        self.__cur_modified_list = []
+        self.__fixups = {}          # symbol -> [instruction, symbols waited, BASE] entries
+        self.__location = 0
+        self.__length = 0
+        self.__extdef_table[block] = {}
+        self.__extref_table[block] = []
+        self.__stream.begin(block, 0, self.__extdef_table[block], self.__extref_table[block])
+        instr.location = 0
+        self.__define(block, 0)
+
+    # section length counts every located instruction, same as write_file
+    def __one_pass_length(self, end) -> None:
+        if end > self.__length:
+            self.__length = end
+
+    def __one_pass_instruction(self, instr) -> None:
+        instr.location = self.__location
+        if instr.symbol is not None:
+            self.__define(instr.symbol, instr.location)
+        # add literal
+        if instr.operand is not None and instr.operand[0] == '=':
+            if instr.operand not in self.__literal_table:
+                self.__literal_table[instr.operand] = None
+
+        encoder = self.__encoder_table.get(instr.mnemonic)
+        waiting = self.__forward_references(instr, encoder)
+        if not waiting:
+            try:
+                encoder(self, instr)
+            except SyntaxError:
+                # may be in range of BASE defined later
+                if self.__base_symbol is None or encoder != Assembler.__encode_format34:
+                    raise
+                waiting = [self.__base_symbol]
+        if waiting:
+            # placeholder of the same size, patched when every symbol is defined
+            fixup = [instr, len(waiting), self.__b_loc if self.__base_symbol is None else self.__base_symbol]
+            for name in waiting:
+                self.__fixups.setdefault(name, []).append(fixup)
+            size = 4 if instr.mnemonic[0] == '+' else 3
+            self.__stream.code(instr.location, bytes(size), hold=True)
         else:
-            sorted_opt.append(opt)
+            size = len(instr.opcode)
+            self.__stream.code(instr.location, bytes(instr.opcode))
+            # only code waiting for patch is kept
+            instr.opcode = None
+        self.__location += size
+        self.__one_pass_length(self.__location)
 
-    opts, args = getopt(sorted_opt, 'a:o:')
-    
-    read_file = args[0]
-    # default set the output file is output.txt
-    write_file = 'output.txt'
+    # symbols an instruction refers to that are not defined yet, literal waits for its pool
+    def __forward_references(self, instr, encoder) -> list:
+        if instr.mnemonic == 'WORD':
+            names = self.__compile(instr).symbols
+        elif encoder == Assembler.__encode_format34 and instr.operand is not None:
+            first_element = instr.operand[0] if isinstance(instr.operand, list) else instr.operand
+            if first_element[0] == '=':
+                return [first_element]
+            names = [first_element[1:] if first_element[0] in '#@' else first_element]
+        else:
+            return []
+        return [
+            name for name in names
+            if name not in self.__cur_symbols and name not in self.__cur_extref and not name.isdigit()
+        ]
+
+    # define symbol, code waiting for it is encoded and patched, EQU waiting for it is defined
+    def __define(self, name, value) -> None:
+        ready = [(name, value)]
+        while ready:
+            name, value = ready.pop()
+            self.__cur_symbols[name] = value
+            if name == self.__base_symbol:
+                self.__b_loc = value
+                self.__base_symbol = None
+            for fixup in self.__fixups.pop(name, ()):
+                fixup[1] -= 1
+                if fixup[1] > 0:
+                    continue
+                if fixup[0].mnemonic == 'EQU':
+                    ready.append(self.__one_pass_equ(fixup[0]))
+                else:
+                    self.__encode_fixup(fixup)
+
+    # EQU with every symbol defined, return symbol and value
+    def __one_pass_equ(self, instr) -> tuple:
+        self.__resolve_equ(self.__cur_symbols, self.__cur_extref, [instr], self.__cur_absolute)
+        return instr.symbol, self.__cur_symbols[instr.symbol]
+
+    # encode with BASE at the time the instruction was read
+    def __encode_fixup(self, fixup) -> None:
+        instr, _, base = fixup
+        b_loc = self.__b_loc
+        self.__b_loc = self.__cur_symbols.get(base) if isinstance(base, str) else base
+        try:
+            self.__encoder_table[instr.mnemonic](self, instr)
+        finally:
+            self.__b_loc = b_loc
+        self.__stream.patch(instr.location, bytes(instr.opcode))
+        instr.opcode = None
+
+    def __place_literal_pool(self, instr) -> None:
+        for literal in self.__literal_table:
+            pool = Instruction(instr.line, symbol='*', mnemonic=literal, location=self.__location)
+            # same literal may be placed again by later LTORG
+            self.__cur_literals.setdefault(literal, []).append(pool.location)
+            self.__encode_literal(pool)
+            self.__stream.code(pool.location, bytes(pool.opcode))
+            self.__location += len(pool.opcode)
+            self.__one_pass_length(self.__location)
+            self.__define(literal, pool.location)
+        self.__literal_table.clear()
+
+    # END symbol may be in current section or in START section whose E record is held
+    def __end_one_pass_program(self, instr) -> None:
+        entry = None
+        entry_block = None
+        if instr.operand in self.__cur_symbols:
+            entry, entry_block = self.__cur_symbols[instr.operand], self.__cur_block
+        elif instr.operand is not None:
+            symbol = self.symbol_index.get(instr.operand)
+            if symbol is not None and symbol.section is not None:
+                if symbol.section != self.__first_block:
+                    raise SyntaxError(f'line {instr.line}: END symbol must be in first or last control section')
+                entry, entry_block = symbol.value, symbol.section
+        self.__end_one_pass_section(entry if entry_block == self.__cur_block else None)
+        self.__stream.set_entry(entry if entry_block == self.__first_block else None)
+        self.__cur_block = None
+
+    def __end_one_pass_section(self, entry=None, hold_entry=False) -> None:
+        block = self.__cur_block
+        # EQU still waiting may wait for each other, reported as in two pass mode
+        waiting = {id(fixup[0]): fixup[0] for fixups in self.__fixups.values() for fixup in fixups
+                   if fixup[0].mnemonic == 'EQU'}
+        equ = sorted(waiting.values(), key=lambda instr: instr.line)
+        _, cycle = topological_order({instr.symbol: self.__compile(instr).symbols for instr in equ})
+        if cycle:
+            line = min(instr.line for instr in equ if instr.symbol in cycle)
+            raise SyntaxError(f'line {line}: circular EQU definition')
+        for fixups in self.__fixups.values():
+            raise SyntaxError(f'line {fixups[0][0].line}: symbol has not been defined')
+        if self.__base_symbol is not None:
+            raise SyntaxError(f'line {self.__base_line}: symbol has not been defined')
+        extdef = self.__extdef_table[block]
+        for name in extdef:
+            extdef[name] = self.__cur_symbols.get(name)
+            if extdef[name] is None:
+                raise SyntaxError(f'line {self.line}: EXTDEF symbol {name} has not been defined')
+
+        # patched code adds M records out of order
+        self.__cur_modified_list.sort(key=lambda modified: modified['location'])
+        self.__stream.end(self.__length, extdef, [
+            (modified['location'], modified['byte'], modified['offset'])
+            for modified in self.__cur_modified_list
+        ], entry, hold_entry)
+
+        self.__symbol_table[block] = self.__cur_symbols
+        self.__absolute_table[block] = self.__cur_absolute
+        self.__literal_pool[block] = self.__cur_literals
+        self.__modified_record[block] = self.__cur_modified_list
+        self.__index_section(block)
+
+# control sections inherited by forked pass two workers
+_shared_sections = None
+
+# pass two of one control section in worker process
+def encode_section(opcode_path, symbol_table, literal_pool, absolute, b_loc, instructions) -> tuple:
+    if isinstance(instructions, int):
+        instructions = _shared_sections[instructions]
+    asm = Assembler(opcode_path)
     try:
-        write_file = [arg for opt, arg in opts if opt == '-o'][0]
-    except:
-        write_file = 'output.txt'
+        return asm.encode_section(instructions, symbol_table, literal_pool, absolute, b_loc)
+    except SyntaxError:
+        raise
+    except Exception as e:
+        raise SyntaxError(f'line {asm.line}: {type(e).__name__}: {e}')
+
+# assemble source text or lines in memory with a new assembler, the parsed opcode table is shared
+def assemble(source: Union[str, bytes, Iterable[str]], opcode_path=None, file_name=None) -> ObjectProgram:
+    return Assembler(opcode_path).assemble(source, file_name)
+
+# human readable table of Assembler.stats
+def format_stats(stats) -> str:
+    lines = ['{:<12s} {:>10s} {:>12s}'.format('phase', 'seconds', 'live blocks')]
+    for phase, info in stats['phases'].items():
+        lines.append('{:<12s} {:>10.4f} {:>12d}'.format(phase, info['seconds'], info['live_blocks']))
+    # one pass mode only has phases
+    if 'addressing' not in stats:
+        return '\n'.join(lines)
+    lines.append('')
+    for name in ['lines', 'instructions', 'literals', 't_records', 'm_records',
+                 'unresolved_externals', 'reused_sections', 'relaxed_format4', 'relax_rounds',
+                 'literal_pools_added', 'far_literals_manual', 'far_literals_auto', 'literal_bytes_saved']:
+        if name in stats:
+            lines.append('{:<20s} {:>10d}'.format(name, stats[name]))
+    lines.append('')
+    for mode, count in stats['addressing'].items():
+        lines.append('{:<20s} {:>10d}'.format(mode, count))
+    lines.append('')
+    lines.append('{:<12s} {:>10s} {:>10s} {:>10s}'.format('section', 'symbols', 'T records', 'M records'))
+    for name, info in stats['sections'].items():
+        lines.append('{:<12s} {:>10d} {:>10d} {:>10d}'.format(
+            name, info['symbols'], info['t_records'], info['m_records']))
+    return '\n'.join(lines)
+
+# literal pools placed by --auto-ltorg against the manual layout
+def format_literal_report(stats) -> str:
+    return '{} literal pools added, literals out of PC relative reach {} -> {}, {} bytes saved'.format(
+        stats['literal_pools_added'], stats['far_literals_manual'], stats['far_literals_auto'],
+        stats['literal_bytes_saved'])
 
-    asm.execute(read_file, write_file)
-    
\ No newline at end of file
+# "<source>:<line>:<column>: <severity>: <message>" as compilers print
+def format_diagnostic(read_file, diagnostic) -> str:
+    return f'{read_file}:{diagnostic.line}:{diagnostic.column}: {diagnostic.severity}: {diagnostic.message}'
+
+# check one file, nothing is written; return diagnostics or the error reading it
+def check_file(read_file, opcode_path=None, opcode_cache=None, include_cache=None, relax=False,
+               auto_literals=False) -> List[str]:
+    asm = Assembler(opcode_path, opcode_cache, relax=relax, auto_literals=auto_literals)
+    if include_cache is not None:
+        asm.include_cache = SectionCache(include_cache)
+    try:
+        diagnostics = asm.check(read_lines(read_file), read_file)
+    except (OSError, UnicodeDecodeError) as e:
+        return [f'{read_file}: {type(e).__name__}: {e}']
+    finally:
+        if asm.include_cache is not None:
+            asm.include_cache.evict()
+    return [format_diagnostic(read_file, diagnostic) for diagnostic in diagnostics]
+
+# "<source>: line <n>: <message>" of an assembly failure
+def error_message(read_file, asm, error) -> str:
+    if isinstance(error, SyntaxError):
+        return f'{read_file}: {error}'
+    where = f'line {asm.line}: ' if asm.line is not None else ''
+    return f'{read_file}: {where}{type(error).__name__}: {error}'
+
+# assemble one file with a fresh assembler, return error message if failed and statistics
+def assemble_file(read_file, write_file, profile=None, symbols=None, opcode_path=None, opcode_cache=None,
+                  cache_dir=None, cache_size=None, jobs=1, format='text', stats=False, one_pass=False,
+                  include_cache=None, relax=False, auto_literals=False) -> tuple:
+    asm = Assembler(opcode_path, opcode_cache, jobs, stats, relax, auto_literals)
+    cache = SectionCache(cache_dir, cache_size) if cache_dir is not None else None
+    if include_cache is not None:
+        asm.include_cache = SectionCache(include_cache, cache_size)
+    profiler = cProfile.Profile() if profile is not None else None
+    try:
+        if one_pass:
+            run = partial(asm.execute_one_pass, read_file, write_file)
+        else:
+            run = partial(asm.execute, read_file, write_file, cache, format)
+        if profiler is not None:
+            profiler.runcall(run)
+        else:
+            run()
+        if symbols is not None:
+            asm.write_symbol_map(symbols)
+        if asm.include_cache is not None:
+            asm.include_cache.evict()
+    except Exception as e:
+        return error_message(read_file, asm, e), None
+    finally:
+        if profiler is not None:
+            profiler.dump_stats(profile)
+    return None, asm.stats
+
+def main(argv) -> int:
+    # options may appear before or after input files
+    opts, args = gnu_getopt(argv, 'a:o:j:f:', [
+        'opcode=', 'opcode-cache=', 'cache=', 'cache-size=', 'stats', 'stats-json=', 'profile=', 'symbols=', 'one-pass',
+        'include-cache=', 'relax', 'auto-ltorg', 'check',
+    ])
+    opts = dict(opts)
+
+    if not args:
+        print('usage: assembler.py [-o output] [-j jobs] [-f text|bin] input.asm ...', file=sys.stderr)
+        print('  -j: worker processes, default CPU count for several inputs, 1 for the sections of one input',
+              file=sys.stderr)
+        return 2
+
+    # one pass mode streams text records, nothing to cache
+    if '--one-pass' in opts and ('--cache' in opts or opts.get('-f', 'text') != 'text'):
+        print('--one-pass writes text object program only and can not use --cache', file=sys.stderr)
+        return 2
+    # instruction size must be known when it is read
+    if '--one-pass' in opts and ('--relax' in opts or '--auto-ltorg' in opts):
+        print('--one-pass can not use --relax or --auto-ltorg', file=sys.stderr)
+        return 2
+
+    sources = collect_sources(args)
+    opcode_path = opts.get('--opcode')
+    opcode_cache = opts.get('--opcode-cache')
+
+    # report every problem of every source, nothing is written
+    if '--check' in opts:
+        check = partial(
+            check_file,
+            opcode_path=opcode_path,
+            opcode_cache=opcode_cache,
+            include_cache=opts.get('--include-cache'),
+            relax='--relax' in opts,
+            auto_literals='--auto-ltorg' in opts,
+        )
+        failed = False
+        for source in sources:
+            for line in check(source):
+                print(line, file=sys.stderr)
+                failed = failed or ': warning: ' not in line
+        return 1 if failed else 0
+    batch = is_batch(args)
+
+    if not batch:
+        # default set the output file is output.txt
+        write_files = [opts.get('-o', 'output.txt')]
+    else:
+        # in batch mode -o is the output directory
+        output_dir = opts.get('-o', 'output')
+        os.makedirs(output_dir, exist_ok=True)
+        write_files = [output_name(output_dir, source) for source in sources]
+
+    # load opcode table before forking so workers share it
+    load_opcode_table(opcode_path, opcode_cache)
+    assemble = partial(
+        assemble_file,
+        opcode_path=opcode_path,
+        opcode_cache=opcode_cache,
+        cache_dir=opts.get('--cache'),
+        cache_size=int(opts.get('--cache-size', 64)) * 1024 * 1024,
+        format=opts.get('-f', 'text'),
+        # literal pool report comes with statistics
+        stats='--stats' in opts or '--stats-json' in opts or '--auto-ltorg' in opts,
+        one_pass='--one-pass' in opts,
+        include_cache=opts.get('--include-cache'),
+        relax='--relax' in opts,
+        auto_literals='--auto-ltorg' in opts,
+    )
+
+    # profile of each source, <profile>.<name> when several sources
+    profile = opts.get('--profile')
+    if profile is None:
+        profiles = [None] * len(sources)
+    elif batch:
+        profiles = [output_name(profile, source) for source in sources]
+        os.makedirs(profile, exist_ok=True)
+    else:
+        profiles = [profile]
+
+    # symbol map of each source, directory of maps when several sources
+    symbols = opts.get('--symbols')
+    if symbols is None:
+        symbol_maps = [None] * len(sources)
+    elif batch:
+        symbol_maps = [output_name(symbols, source) + '.map' for source in sources]
+        os.makedirs(symbols, exist_ok=True)
+    else:
+        symbol_maps = [symbols]
+
+    jobs = int(opts.get('-j', os.cpu_count() or 1))
+    if jobs <= 1 or len(sources) <= 1:
+        # single source uses workers for its control sections only when -j is given
+        section_jobs = jobs if '-j' in opts else 1
+        results = list(map(partial(assemble, jobs=section_jobs), sources, write_files, profiles, symbol_maps))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(assemble, sources, write_files, profiles, symbol_maps))
+
+    # report every failed file
+    failed = [error for error, _ in results if error is not None]
+    for error in failed:
+        print(error, file=sys.stderr)
+
+    all_stats = {source: stats for source, (_, stats) in zip(sources, results) if stats is not None}
+    if '--stats' in opts:
+        for source, stats in all_stats.items():
+            print(f'{source}\n{format_stats(stats)}\n', file=sys.stderr)
+    elif '--auto-ltorg' in opts:
+        for source, stats in all_stats.items():
+            print(f'{source}: {format_literal_report(stats)}', file=sys.stderr)
+    if '--stats-json' in opts:
+        with open(opts['--stats-json'], mode='w') as f:
+            json.dump(all_stats, f, indent=2)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
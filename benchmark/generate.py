@@ -0,0 +1,118 @@
+import sys
+import random
+from getopt import GetoptError, gnu_getopt
+
+# format 2, 3 and 4 instruction templates, {data} is a label near the instruction
+FORMAT2 = ['CLEAR   X', 'CLEAR   A', 'COMPR   A,S', 'ADDR    S,A', 'TIXR    T', 'RMO     A,B']
+FORMAT3 = ['LDA     {data}', 'STA     {data}', 'ADD     {data}', 'COMP    {data}', 'LDT    #3',
+           'STCH    {data},X', 'LDA    @{data}', 'JEQ     {label}', 'JLT     {label}']
+
+# fixed size of base table, must stay within BASE reach
+BASE_TABLE_WORDS = 64
+# max instructions between literal pools, keeps data and literals within PC reach
+MAX_CHUNK = 400
+
+def ext_name(index) -> str:
+    return f'G{index:05d}'
+
+# generate a valid SIC/XE program line by line
+#   lines          : approximate number of source lines
+#   sections       : number of control sections
+#   literal_density: fraction of instructions using a literal operand
+#   ltorg_every    : instructions between LTORG, also the span of local data references
+#   fanout         : EXTDEF of every section and EXTREF into other sections
+#   mix            : weights of format 2, 3 and 4 instructions
+#   base_reach     : fraction of memory references to the base table at section start,
+#                    these are out of PC reach in large sections and use BASE
+def generate(lines=10000, sections=1, literal_density=0.05, ltorg_every=200,
+             fanout=2, mix=(0.2, 0.7, 0.1), base_reach=0.1, seed=0):
+    rand = random.Random(seed)
+    chunk = max(1, min(ltorg_every, MAX_CHUNK))
+    per_section = max(chunk, lines // sections)
+
+    for section in range(sections):
+        name = f'S{section}'
+        yield f'{name:<8s}{"START" if section == 0 else "CSECT"}   0'
+
+        extdef = [ext_name(section * fanout + i) for i in range(fanout)]
+        extref = []
+        if sections > 1:
+            others = [i for i in range(sections * fanout) if i // fanout != section]
+            extref = [ext_name(i) for i in rand.sample(others, min(fanout, len(others)))]
+        if extdef:
+            yield '        EXTDEF  ' + ','.join(extdef)
+        if extref:
+            yield '        EXTREF  ' + ','.join(extref)
+
+        # base table right after BASE setup, code follows it
+        yield '        LDB    #BT0'
+        yield '        BASE    BT0'
+        yield '        J       MAIN'
+        for i in range(BASE_TABLE_WORDS):
+            yield f'BT{i:<6d}WORD    {i}'
+        for symbol in extdef:
+            yield f'{symbol:<8s}WORD    0'
+        yield 'MAIN    CLEAR   X'
+
+        count = 0
+        block = 0
+        while count < per_section:
+            label = f'L{block}'
+            data = [f'D{block}_{i}' for i in range(8)]
+            for i in range(chunk):
+                kind = rand.choices((2, 3, 4), mix)[0]
+                if kind == 2:
+                    line = rand.choice(FORMAT2)
+                elif kind == 4:
+                    if extref and rand.random() < 0.5:
+                        line = '+JSUB   ' + rand.choice(extref)
+                    else:
+                        line = '+LDA    ' + rand.choice(data)
+                elif rand.random() < literal_density:
+                    line = "LDA    =X'{:06X}'".format(rand.randrange(64))
+                elif rand.random() < base_reach:
+                    line = 'LDA     BT{}'.format(rand.randrange(BASE_TABLE_WORDS))
+                else:
+                    line = rand.choice(FORMAT3).format(data=rand.choice(data), label=label)
+                # first instruction of block is jump target
+                yield f'{label if i == 0 else "":<8s}{line}'
+            for i, symbol in enumerate(data):
+                yield f'{symbol:<8s}WORD    {i}' if i % 2 else f'{symbol:<8s}RESW    1'
+            yield '        LTORG'
+            count += chunk + len(data) + 1
+            block += 1
+
+    yield '        END     S0'
+
+def main(argv) -> int:
+    try:
+        opts, args = gnu_getopt(argv, 'o:', [
+            'lines=', 'sections=', 'literal-density=', 'ltorg-every=',
+            'fanout=', 'mix=', 'base-reach=', 'seed=',
+        ])
+    except GetoptError as e:
+        print(f'generate.py: {e}', file=sys.stderr)
+        print('usage: generate.py [-o output] [--lines n] [--sections n] [--literal-density f] [--ltorg-every n]'
+              ' [--fanout n] [--mix f2,f3,f4] [--base-reach f] [--seed n]', file=sys.stderr)
+        return 2
+    opts = dict(opts)
+    source = generate(
+        lines=int(opts.get('--lines', 10000)),
+        sections=int(opts.get('--sections', 1)),
+        literal_density=float(opts.get('--literal-density', 0.05)),
+        ltorg_every=int(opts.get('--ltorg-every', 200)),
+        fanout=int(opts.get('--fanout', 2)),
+        mix=tuple(float(weight) for weight in opts.get('--mix', '0.2,0.7,0.1').split(',')),
+        base_reach=float(opts.get('--base-reach', 0.1)),
+        seed=int(opts.get('--seed', 0)),
+    )
+    output = open(opts['-o'], mode='w') if '-o' in opts else sys.stdout
+    try:
+        output.writelines(line + '\n' for line in source)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
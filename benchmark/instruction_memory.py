@@ -0,0 +1,46 @@
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from assembler import Assembler
+
+# measure bytes per instruction record, dict (before) against Instruction (after)
+def measure(records, build) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = [build(instr) for instr in records]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(built)
+
+# old per-line dict, only keys that were set
+def as_dict(instr) -> dict:
+    record = {}
+    for name in ('symbol', 'mnemonic', 'operand', 'location', 'opcode'):
+        value = getattr(instr, name)
+        if value is not None:
+            record[name] = value
+    return record
+
+# new record, copy of the slotted instruction
+def as_instruction(instr):
+    copy = type(instr).__new__(type(instr))
+    for name in instr.__slots__:
+        setattr(copy, name, getattr(instr, name))
+    return copy
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else 'input/2-15.asm'
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    asm = Assembler()
+    asm.read_file(source)
+    asm.pass_one()
+    asm.pass_two()
+    records = asm.instruction * repeat
+
+    print(f'{len(records)} instructions from {source}')
+    print('dict        : {:7.1f} bytes/instruction'.format(measure(records, as_dict)))
+    print('Instruction : {:7.1f} bytes/instruction'.format(measure(records, as_instruction)))
@@ -0,0 +1,34 @@
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from assembler import Assembler
+from generate import generate
+
+# time pass two only
+def time_pass_two(file_name, jobs) -> float:
+    asm = Assembler(jobs=jobs)
+    asm.read_file(file_name)
+    asm.pass_one()
+    start = time.perf_counter()
+    asm.pass_two()
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+
+    print(f'{lines} lines, {jobs} jobs')
+    print('sections   serial   parallel   speedup')
+    for sections in (1, 2, 4, 8, 16, 32):
+        with tempfile.NamedTemporaryFile('w', suffix='.asm', delete=False) as f:
+            f.writelines(line + '\n' for line in generate(lines=lines, sections=sections))
+        try:
+            serial = time_pass_two(f.name, 1)
+            parallel = time_pass_two(f.name, jobs)
+        finally:
+            os.remove(f.name)
+        print('{:8d} {:7.3f}s {:9.3f}s {:8.2f}x'.format(sections, serial, parallel, serial / parallel))
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+from getopt import GetoptError, gnu_getopt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from assembler import Assembler
+from generate import generate
+
+PHASES = ['read_file', 'pass_one', 'pass_two', 'write_file']
+
+# benchmark programs, name -> generate() arguments
+CASES = {
+    'small': dict(lines=10000),
+    'sections': dict(lines=100000, sections=16, fanout=4),
+    'literals': dict(lines=100000, literal_density=0.3, ltorg_every=100),
+    'base': dict(lines=100000, base_reach=0.5),
+    'format4': dict(lines=100000, sections=4, mix=(0.1, 0.5, 0.4)),
+    'large': dict(lines=1000000, sections=8),
+}
+
+# run every phase once, return seconds and traced peak bytes of each phase
+def run_phases(source, output, trace) -> dict:
+    asm = Assembler()
+    result = {}
+    for phase in PHASES:
+        if phase == 'read_file':
+            call = lambda: asm.read_file(source)
+        elif phase == 'write_file':
+            call = lambda: asm.write_file(output)
+        else:
+            call = getattr(asm, phase)
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        call()
+        result[phase] = {'seconds': time.perf_counter() - start}
+        if trace:
+            result[phase]['peak_bytes'] = tracemalloc.get_traced_memory()[1] - before
+    return result
+
+# best time of several runs, peak memory from one traced run
+def bench_case(name, arguments, repeat) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, name + '.asm')
+        output = os.path.join(directory, name + '.obj')
+        with open(source, mode='w') as f:
+            lines = 0
+            for line in generate(**arguments):
+                f.write(line + '\n')
+                lines += 1
+
+        runs = [run_phases(source, output, False) for _ in range(repeat)]
+        tracemalloc.start()
+        try:
+            traced = run_phases(source, output, True)
+        finally:
+            tracemalloc.stop()
+
+    phases = {}
+    for phase in PHASES:
+        phases[phase] = {
+            'seconds': min(run[phase]['seconds'] for run in runs),
+            'peak_bytes': traced[phase]['peak_bytes'],
+        }
+    return {
+        'arguments': arguments,
+        'lines': lines,
+        'seconds': sum(phase['seconds'] for phase in phases.values()),
+        'phases': phases,
+    }
+
+# print ratio of every phase against a previous result
+def compare(result, baseline) -> None:
+    print('{:10s} {:10s} {:>10s} {:>10s} {:>7s}'.format('case', 'phase', 'baseline', 'current', 'ratio'))
+    for name, case in result['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        for phase in PHASES + ['total']:
+            if phase == 'total':
+                old, new = baseline['cases'][name]['seconds'], case['seconds']
+            else:
+                old = baseline['cases'][name]['phases'][phase]['seconds']
+                new = case['phases'][phase]['seconds']
+            print('{:10s} {:10s} {:9.3f}s {:9.3f}s {:6.2f}x'.format(name, phase, old, new, new / old))
+
+def main(argv) -> int:
+    try:
+        opts, args = gnu_getopt(argv, 'o:r:', ['compare='])
+    except GetoptError as e:
+        print(f'run.py: {e}', file=sys.stderr)
+        print('usage: run.py [-o result.json] [-r repeat] [--compare result.json] [case ...]', file=sys.stderr)
+        return 2
+    opts = dict(opts)
+    names = args or [name for name in CASES if name != 'large']
+    repeat = int(opts.get('-r', 3))
+
+    result = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cases': {},
+    }
+    for name in names:
+        case = bench_case(name, CASES[name], repeat)
+        result['cases'][name] = case
+        print('{:10s} {:8d} lines {:8.3f}s  '.format(name, case['lines'], case['seconds']) + '  '.join(
+            '{} {:.3f}s/{:.1f}MB'.format(phase, info['seconds'], info['peak_bytes'] / 2 ** 20)
+            for phase, info in case['phases'].items()
+        ))
+
+    if '-o' in opts:
+        with open(opts['-o'], mode='w') as f:
+            json.dump(result, f, indent=2)
+    if '--compare' in opts:
+        with open(opts['--compare'], mode='r') as f:
+            compare(result, json.load(f))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
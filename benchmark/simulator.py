@@ -0,0 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from linker import link_files
+from simulator import Device, Simulator
+
+# copy records through COPY of figure 2.15, report instructions per second and hottest loop
+if __name__ == '__main__':
+    object_file = sys.argv[1] if len(sys.argv) > 1 else 'output/2-15'
+    records = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    sim = Simulator()
+    sim.load(link_files([object_file], 0x4000))
+    sim.devices[0xF1] = Device(b'SIC/XE SIMULATOR BENCHMARK RECORD\0' * records)
+    sim.run()
+
+    print('halted       {}'.format(sim.halted))
+    print('instructions {:d}'.format(sim.instructions))
+    print('seconds      {:.4f}'.format(sim.seconds))
+    print('ips          {:.0f}'.format(sim.instructions_per_second()))
+    for address, mnemonic, count in sim.hot_addresses(5):
+        print('{:06X}  {:<8s}{:>12d}'.format(address, mnemonic, count))
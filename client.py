@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import base64
+import socket
+from getopt import GetoptError, gnu_getopt
+
+from sources import collect_sources, is_batch, output_name
+
+# same command line as assembler.py, sources are sent to a running server.py
+# assembler module is imported only when falling back, to keep startup short
+
+# options server can handle, any other option runs the local assembler
+SERVER_OPTIONS = frozenset(['-o', '-f', '-j', '--socket'])
+LONG_OPTIONS = [
+    'opcode=', 'opcode-cache=', 'cache=', 'cache-size=', 'stats', 'stats-json=', 'profile=',
+    'symbols=', 'one-pass', 'include-cache=', 'relax', 'auto-ltorg', 'check', 'socket=',
+]
+
+# send every request on one connection, responses come back in request order
+def send_requests(path, requests) -> list:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        with sock.makefile('rwb') as stream:
+            for request in requests:
+                stream.write(json.dumps(request).encode() + b'\n')
+            stream.flush()
+            sock.shutdown(socket.SHUT_WR)
+            responses = []
+            for _ in requests:
+                line = stream.readline()
+                # server stopped before answering every request
+                if not line:
+                    raise ConnectionError('server closed connection')
+                responses.append(json.loads(line))
+            return responses
+
+# argv without --socket for local assembler
+def local_argv(argv) -> list:
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == '--socket':
+            skip = True
+        elif not arg.startswith('--socket='):
+            result.append(arg)
+    return result
+
+def run_local(argv) -> int:
+    import assembler
+    return assembler.main(local_argv(argv))
+
+def main(argv) -> int:
+    try:
+        opt_list, args = gnu_getopt(argv, 'a:o:j:f:', LONG_OPTIONS)
+    except GetoptError:
+        return run_local(argv)
+    opts = dict(opt_list)
+    path = opts.get('--socket', os.environ.get('SICXE_ASSEMBLER_SOCKET'))
+    if path is None or not args or any(opt not in SERVER_OPTIONS for opt in opts):
+        return run_local(argv)
+
+    sources = collect_sources(args)
+    format = opts.get('-f', 'text')
+    batch = is_batch(args)
+    if not batch:
+        write_files = [opts.get('-o', 'output.txt')]
+    else:
+        output_dir = opts.get('-o', 'output')
+        os.makedirs(output_dir, exist_ok=True)
+        write_files = [output_name(output_dir, source) for source in sources]
+
+    failed = []
+    requests = []
+    for index, source in enumerate(sources):
+        try:
+            with open(source, mode='r') as f:
+                requests.append({
+                    'id': index, 'name': source, 'path': os.path.abspath(source), 'source': f.read(), 'format': format,
+                })
+        except OSError as e:
+            failed.append(f'{source}: {type(e).__name__}: {e}')
+
+    try:
+        responses = send_requests(path, requests)
+    except (OSError, ValueError):
+        # no server running, or it died or replied garbage, nothing is written yet
+        return run_local(argv)
+
+    for response in responses:
+        if not response['ok']:
+            failed.append(response['error'])
+            continue
+        write_file = write_files[response['id']]
+        if format == 'bin':
+            with open(write_file, mode='wb') as f:
+                f.write(base64.b64decode(response['object']))
+        else:
+            with open(write_file, mode='w') as f:
+                f.write(response['object'])
+
+    # report every failed file
+    for error in failed:
+        print(error, file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
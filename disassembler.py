@@ -0,0 +1,152 @@
+import sys
+from getopt import gnu_getopt
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+
+from assembler import REGISTER_CODE, load_opcode_table
+from objfile import ObjectSection, TextIndex, open_object
+
+REGISTER_NAME = {code: name for name, code in REGISTER_CODE.items()}
+
+# format 2 with one register, or a register and a count
+ONE_REGISTER_MNEMONICS = frozenset(['CLEAR', 'TIXR'])
+SHIFT_MNEMONICS = frozenset(['SHIFTL', 'SHIFTR'])
+
+# one disassembled instruction, or BYTE for code that is not an instruction
+class Line(NamedTuple):
+    location: int
+    code: bytes
+    mnemonic: str
+    operand: str
+    flags: str          # nixbpe of format 3/4, empty otherwise
+
+# opcode value -> (mnemonic, format)
+def reverse_opcode_table(opcode_path=None) -> Dict[int, Tuple[str, int]]:
+    return {
+        opcode.code: (mnemonic, opcode.format[0])
+        for mnemonic, opcode in load_opcode_table(opcode_path).opcode.items()
+    }
+
+# operand of format 3/4, target address when it is known from the instruction alone
+def format_operand(location, length, ni, flags, disp, extref) -> str:
+    x, b, p = flags >> 3 & 1, flags >> 2 & 1, flags >> 1 & 1
+    if extref is not None:
+        operand = extref
+    elif p:
+        # PC relative, displacement is signed
+        disp = disp - 0x1000 if disp & 0x800 else disp
+        operand = '{:X}'.format((location + length + disp) & 0xFFFFF)
+    elif b:
+        operand = '{:X}(B)'.format(disp)
+    else:
+        operand = '{:X}'.format(disp)
+    prefix = {1: '#', 2: '@'}.get(ni, '')
+    return prefix + operand + (',X' if x else '')
+
+# decode one instruction at location, None when the bytes are not an instruction
+def decode(index: TextIndex, location, opcode, modified, section_name) -> Optional[Line]:
+    first = index.byte(location)
+    entry = opcode.get(first & 0xFC)
+    if entry is None:
+        return None
+    mnemonic, format = entry
+
+    if format == 1:
+        return Line(location, bytes([first]), mnemonic, '', '')
+
+    if format == 2:
+        code = index.read(location, 2)
+        if code is None:
+            return None
+        r1, r2 = code[1] >> 4, code[1] & 0xF
+        if mnemonic == 'SVC':
+            operand = str(r1)
+        elif mnemonic in SHIFT_MNEMONICS:
+            operand = '{},{}'.format(REGISTER_NAME.get(r1, r1), r2 + 1)
+        elif mnemonic in ONE_REGISTER_MNEMONICS:
+            operand = REGISTER_NAME.get(r1, str(r1))
+        else:
+            operand = '{},{}'.format(REGISTER_NAME.get(r1, r1), REGISTER_NAME.get(r2, r2))
+        return Line(location, code, mnemonic, operand, '')
+
+    code = index.read(location, 3)
+    if code is None:
+        return None
+    ni = first & 3
+    if ni == 0:
+        # SIC instruction, 15 bit address with x
+        operand = '{:X}'.format((code[1] & 0x7F) << 8 | code[2]) + (',X' if code[1] & 0x80 else '')
+        return Line(location, code, mnemonic, operand, '00{}000'.format(code[1] >> 7))
+
+    flags = code[1] >> 4
+    if flags & 1:
+        code = index.read(location, 4)
+        if code is None:
+            return None
+        disp = (code[1] & 0xF) << 16 | code[2] << 8 | code[3]
+        mnemonic = '+' + mnemonic
+    else:
+        disp = (code[1] & 0xF) << 8 | code[2]
+    # external symbol added by M record into the address field
+    extref = modified.get(location + 1)
+    if extref is not None:
+        # relocation by own section start keeps the address
+        extref = None if extref[1:] == section_name else extref.lstrip('+')
+    operand = format_operand(location, len(code), ni, flags, disp, extref)
+    return Line(location, code, mnemonic, operand, '{:02b}{:04b}'.format(ni, flags))
+
+# disassemble T records of a section in location order
+def disassemble(section: ObjectSection, opcode: Dict[int, Tuple[str, int]]) -> Iterator[Line]:
+    index = TextIndex(section)
+    modified = {location: symbol for location, _, symbol in section.modified}
+    location = 0
+    for span_location, start, end in index.spans:
+        # previous instruction may run into this span
+        location = max(location, span_location)
+        while location < span_location + end - start:
+            line = decode(index, location, opcode, modified, section.name)
+            if line is None:
+                line = Line(location, bytes([index.byte(location)]), 'BYTE', '', '')
+            yield line
+            location += len(line.code)
+
+def format_listing(section, opcode) -> Iterator[str]:
+    yield '{} start {:06X} length {:06X}\n'.format(section.name, section.start, section.length)
+    for line in disassemble(section, opcode):
+        if line.mnemonic == 'BYTE':
+            operand = "X'{}'".format(line.code.hex().upper())
+        else:
+            operand = line.operand
+        yield '{:06X}  {:<10s}{:<8s}{:<8s}{}\n'.format(
+            line.location, line.code.hex().upper(), line.flags, line.mnemonic, operand).rstrip() + '\n'
+    yield '\n'
+
+def main(argv) -> int:
+    opts, args = gnu_getopt(argv, 's:a:', ['opcode='])
+    if len(args) != 1:
+        print('usage: disassembler.py [-s section] [-a address] [--opcode file] object', file=sys.stderr)
+        return 2
+    options = dict(opts)
+    names = [value for opt, value in opts if opt == '-s']
+
+    try:
+        opcode = reverse_opcode_table(options.get('--opcode'))
+        with open_object(args[0]) as obj:
+            for name in names or obj.names():
+                section = obj.section(name)
+                if '-a' in options:
+                    # byte at a section location
+                    location = int(options['-a'], 16)
+                    byte = TextIndex(section).byte(location)
+                    print('{} {:06X} {}'.format(name, location, '--' if byte is None else '{:02X}'.format(byte)))
+                else:
+                    sys.stdout.writelines(format_listing(section, opcode))
+    except KeyError as e:
+        print(f'disassembler.py: no section {e}', file=sys.stderr)
+        return 1
+    except (OSError, SyntaxError, ValueError) as e:
+        print(f'disassembler.py: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
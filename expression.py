@@ -0,0 +1,165 @@
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# number, symbol, operator or parenthesis, white space between them is ignored
+TOKEN_PATTERN = re.compile(r'\s*(?:(\d+)|([A-Za-z_][A-Za-z0-9_]*)|([-+*/()]))')
+
+# binding power of binary operators
+PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2}
+
+# postfix program operations
+NUMBER, SYMBOL, LOCATION, NEGATE, BINARY = range(5)
+
+# value of an expression with its relocation terms
+#   terms : symbol -> coefficient, None is the start of the current control section
+class Value(NamedTuple):
+    value: int
+    terms: Dict[Optional[str], int]
+
+# add terms scaled by sign, drop terms that cancel out
+def merge_terms(left, right, sign) -> dict:
+    terms = dict(left)
+    for name, coefficient in right.items():
+        coefficient = terms.get(name, 0) + sign * coefficient
+        if coefficient:
+            terms[name] = coefficient
+        else:
+            terms.pop(name, None)
+    return terms
+
+def apply_operator(operator, left, right) -> Value:
+    if operator == '+':
+        return Value(left.value + right.value, merge_terms(left.terms, right.terms, 1))
+    elif operator == '-':
+        return Value(left.value - right.value, merge_terms(left.terms, right.terms, -1))
+    elif operator == '*':
+        if left.terms and right.terms:
+            raise ValueError('relocatable term in multiplication')
+        scale, terms = (left.value, right.terms) if right.terms else (right.value, left.terms)
+        return Value(left.value * right.value, {name: c * scale for name, c in terms.items() if c * scale})
+    else:
+        if left.terms or right.terms:
+            raise ValueError('relocatable term in division')
+        if right.value == 0:
+            raise ValueError('division by zero')
+        # integer division truncates toward zero
+        quotient = abs(left.value) // abs(right.value)
+        return Value(quotient if (left.value < 0) == (right.value < 0) else -quotient, {})
+
+# expression compiled into postfix operations
+class Expression:
+    __slots__ = ('text', 'program', 'symbols')
+
+    def __init__(self, text: str, program: List[Tuple[int, object]]) -> None:
+        self.text = text
+        self.program = program
+        # symbols in order of first use, for dependency graph
+        self.symbols = tuple(dict.fromkeys(arg for op, arg in program if op == SYMBOL))
+
+    # resolve(symbol) returns Value of the symbol, location is value of '*'
+    def evaluate(self, resolve: Callable[[str], Value], location: Optional[int] = None) -> Value:
+        stack = []
+        for op, arg in self.program:
+            if op == NUMBER:
+                stack.append(Value(arg, {}))
+            elif op == SYMBOL:
+                stack.append(resolve(arg))
+            elif op == LOCATION:
+                if location is None:
+                    raise ValueError('"*" can not be used here')
+                stack.append(Value(location, {None: 1}))
+            elif op == NEGATE:
+                value = stack.pop()
+                stack.append(Value(-value.value, {name: -c for name, c in value.terms.items()}))
+            else:
+                right = stack.pop()
+                stack.append(apply_operator(arg, stack.pop(), right))
+        return stack[0]
+
+    def __repr__(self) -> str:
+        return f'Expression({self.text!r})'
+
+# split expression into tokens, '*' is location or multiplication decided by parser
+def tokenize_expression(text) -> List[str]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if match is None:
+            raise ValueError(f'invalid expression {text}')
+        tokens.append(match.group(match.lastindex))
+        position = match.end()
+    return tokens
+
+# parse with shunting yard, same text is compiled once
+@lru_cache(maxsize=4096)
+def compile_expression(text) -> Expression:
+    program = []
+    operators = []          # pending operators and '('
+    expect_operand = True   # operand or unary operator comes next
+
+    def reduce(until) -> None:
+        while operators and operators[-1] != '(' and until(operators[-1]):
+            operator = operators.pop()
+            program.append((NEGATE, None) if operator == 'neg' else (BINARY, operator))
+
+    for token in tokenize_expression(text):
+        if expect_operand:
+            if token.isdigit():
+                program.append((NUMBER, int(token)))
+                expect_operand = False
+            elif token == '*':
+                program.append((LOCATION, None))
+                expect_operand = False
+            elif token == '(':
+                operators.append(token)
+            elif token == '-':
+                operators.append('neg')
+            elif token == '+':
+                pass
+            elif token[0].isalpha() or token[0] == '_':
+                program.append((SYMBOL, token))
+                expect_operand = False
+            else:
+                raise ValueError(f'invalid expression {text}')
+        elif token == ')':
+            reduce(lambda operator: True)
+            if not operators:
+                raise ValueError(f'unbalanced parenthesis in {text}')
+            operators.pop()
+        elif token in PRECEDENCE:
+            # left associative, unary minus binds tighter than any binary operator
+            reduce(lambda operator: operator == 'neg' or PRECEDENCE[operator] >= PRECEDENCE[token])
+            operators.append(token)
+            expect_operand = True
+        else:
+            raise ValueError(f'invalid expression {text}')
+
+    if expect_operand:
+        raise ValueError(f'invalid expression {text}')
+    reduce(lambda operator: True)
+    if operators:
+        raise ValueError(f'unbalanced parenthesis in {text}')
+    return Expression(text, program)
+
+# order symbols so that each comes after the symbols it depends on
+#   dependencies : symbol -> symbols it refers to, others are already known
+# return ordered symbols and symbols left in a cycle
+def topological_order(dependencies) -> Tuple[List[str], List[str]]:
+    waiting = {}
+    dependents = {}
+    for name, refers in dependencies.items():
+        refers = [refer for refer in set(refers) if refer in dependencies]
+        waiting[name] = len(refers)
+        for refer in refers:
+            dependents.setdefault(refer, []).append(name)
+
+    order = [name for name, count in waiting.items() if count == 0]
+    for name in order:
+        for dependent in dependents.get(name, ()):
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                order.append(dependent)
+    return order, [name for name, count in waiting.items() if count > 0]
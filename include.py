@@ -0,0 +1,68 @@
+import os
+import hashlib
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# bump when the cached token format changes
+VERSION = 1
+
+# tokenized files kept in this process, oldest is dropped first
+MEMO_SIZE = 256
+
+# (path, mtime, size) -> tokenized lines
+_memo = {}
+
+# tokenized lines of a file, lexed only when neither this process nor the disk cache has it
+#   tokenize : lines -> (line number, tokens)
+#   cache    : object with get(key) and put(key, entry), e.g. SectionCache, or None
+def load_tokens(path, tokenize, cache=None) -> List[Tuple[int, List[str]]]:
+    stat = os.stat(path)
+    memo_key = (path, stat.st_mtime_ns, stat.st_size)
+    tokenized = _memo.get(memo_key)
+    if tokenized is not None:
+        return tokenized
+
+    key = hashlib.sha256(repr(('include', VERSION, path)).encode()).hexdigest()
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None and (entry['mtime'], entry['size']) == (stat.st_mtime_ns, stat.st_size):
+        tokenized = entry['tokens']
+    else:
+        with open(path, mode='rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        # touched but unchanged file keeps its tokens
+        if entry is not None and entry['digest'] == digest:
+            tokenized = entry['tokens']
+        else:
+            tokenized = list(tokenize(data.decode().splitlines()))
+        if cache is not None:
+            cache.put(key, {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'digest': digest, 'tokens': tokenized})
+
+    if len(_memo) >= MEMO_SIZE:
+        del _memo[next(iter(_memo))]
+    _memo[memo_key] = tokenized
+    return tokenized
+
+# replace "INCLUDE file" lines with the tokens of the file, file name is relative to the including file
+# included lines take the line number of their INCLUDE
+#   including : real paths of the files being read, for cycle detection
+def expand_includes(lines: Iterable[Tuple[int, List[str]]], tokenize, directory: Optional[str] = None, cache=None,
+                    including: Tuple[str, ...] = ()) -> Iterator[Tuple[int, List[str]]]:
+    for line_no, tokens in lines:
+        if tokens[0] != 'INCLUDE':
+            yield line_no, tokens
+            continue
+        if len(tokens) != 2:
+            raise SyntaxError(f'line {line_no}: INCLUDE must have one file name')
+
+        path = os.path.realpath(os.path.join(directory or '', tokens[1].strip('\'"')))
+        if path in including:
+            chain = ' -> '.join(os.path.basename(name) for name in including + (path,))
+            raise SyntaxError(f'line {line_no}: include cycle {chain}')
+        try:
+            tokenized = load_tokens(path, tokenize, cache)
+        except (OSError, UnicodeDecodeError) as e:
+            raise SyntaxError(f'line {line_no}: can not include {tokens[1]}: {e}')
+
+        yield from expand_includes(
+            ((line_no, list(included)) for _, included in tokenized),
+            tokenize, os.path.dirname(path), cache, including + (path,))
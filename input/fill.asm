@@ -0,0 +1,20 @@
+MAIN    START   0
+        EXTDEF  BUF
+        EXTREF  FILL
+FIRST   STL     RETADR
+       +JSUB    FILL
+        J      @RETADR
+RETADR  RESW    1
+BUF     RESW    100
+FILL    CSECT
+        EXTREF  BUF
+        CLEAR   X
+        LDS    #3
+        LDT    #300
+        LDA    #7
+LOOP   +STA     BUF,X
+        ADDR    S,X
+        COMPR   X,T
+        JLT     LOOP
+        RSUB
+        END     FIRST
@@ -0,0 +1,141 @@
+import sys
+from contextlib import ExitStack
+from getopt import gnu_getopt
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from objfile import ObjectSection, open_object
+
+# control section placed in memory
+class LoadedSection(NamedTuple):
+    name: str
+    address: int
+    length: int
+    extdef: List[Tuple[str, int]]   # symbol and its loaded address
+
+# absolute memory image of linked control sections
+class LoadImage:
+    __slots__ = ('address', 'memory', 'estab', 'sections', 'entry')
+
+    def __init__(self, address: int, memory: bytearray, estab: Dict[str, int],
+                 sections: List[LoadedSection], entry: int) -> None:
+        self.address = address      # load address of first section
+        self.memory = memory        # memory from load address
+        self.estab = estab          # control section or EXTDEF symbol -> address
+        self.sections = sections
+        self.entry = entry          # address execution starts
+
+    def __repr__(self) -> str:
+        return f'LoadImage(address={self.address:#x}, length={len(self.memory):#x}, entry={self.entry:#x})'
+
+# pass one: lay out sections from address and build external symbol table
+def build_estab(sections, address) -> Tuple[Dict[str, int], List[LoadedSection]]:
+    estab = {}
+    loaded = []
+    csaddr = address
+    for section in sections:
+        if section.name in estab:
+            raise ValueError(f'duplicate external symbol {section.name}')
+        estab[section.name] = csaddr
+        extdef = []
+        for symbol, value in section.extdef.items():
+            if symbol in estab:
+                raise ValueError(f'duplicate external symbol {symbol}')
+            estab[symbol] = csaddr + value - section.start
+            extdef.append((symbol, estab[symbol]))
+        loaded.append(LoadedSection(section.name, csaddr, section.length, extdef))
+        csaddr += section.length
+    return estab, loaded
+
+# pass two: copy T records and apply M records of each section into one memory image
+def load_sections(sections, estab, loaded, address) -> Tuple[bytearray, int]:
+    memory = bytearray(sum(section.length for section in sections))
+    entry = None
+    for section, placed in zip(sections, loaded):
+        base = placed.address - section.start - address    # section location -> memory index
+        code = memoryview(section.code)
+        for location, start, end in section.text:
+            memory[base + location:base + location + end - start] = code[start:end]
+
+        for location, half_bytes, symbol in section.modified:
+            value = estab.get(symbol[1:])
+            if value is None:
+                raise ValueError(f'{section.name}: undefined external symbol {symbol[1:]}')
+            # field is the low half bytes of the bytes it covers
+            index = base + location
+            size = (half_bytes + 1) // 2
+            if index < 0 or index + size > len(memory):
+                raise ValueError(f'{section.name}: modification at {location:06X} out of section')
+            mask = (1 << half_bytes * 4) - 1
+            word = int.from_bytes(memory[index:index + size], 'big')
+            field = word + value if symbol[0] == '+' else word - value
+            word = (word & ~mask) | (field & mask)
+            memory[index:index + size] = word.to_bytes(size, 'big')
+
+        if section.entry is not None and entry is None:
+            entry = placed.address + section.entry - section.start
+    return memory, entry if entry is not None else address
+
+def link(sections: List[ObjectSection], address: int = 0) -> LoadImage:
+    estab, loaded = build_estab(sections, address)
+    memory, entry = load_sections(sections, estab, loaded, address)
+    return LoadImage(address, memory, estab, loaded, entry)
+
+# link object files, both formats are read through a mapping
+def link_files(file_names, address=0) -> LoadImage:
+    with ExitStack() as stack:
+        sections = []
+        for file_name in file_names:
+            sections += stack.enter_context(open_object(file_name)).sections
+        return link(sections, address)
+
+# load map: address and length of every control section and its EXTDEF symbols
+def format_load_map(image) -> Iterator[str]:
+    yield '{:<10s}{:<10s}{:<10s}{}\n'.format('control', 'symbol', 'address', 'length')
+    yield 'section   name\n'
+    for section in image.sections:
+        yield '{:<10s}{:<10s}{:06X}    {:06X}\n'.format(section.name, '', section.address, section.length)
+        for symbol, address in section.extdef:
+            yield '{:<10s}{:<10s}{:06X}\n'.format('', symbol, address)
+    yield 'entry {:06X}\n'.format(image.entry)
+
+# memory dump, 16 bytes per line in groups of 4
+def format_hex(image) -> Iterator[str]:
+    memory = image.memory
+    for offset in range(0, len(memory), 16):
+        line = memory[offset:offset + 16].hex().upper()
+        yield '{:06X}  {}\n'.format(image.address + offset, ' '.join(line[i:i + 8] for i in range(0, len(line), 8)))
+
+def write_image(file_name, image, format='bin') -> None:
+    if format == 'bin':
+        with open(file_name, mode='wb') as f:
+            f.write(image.memory)
+    elif format == 'hex':
+        with open(file_name, mode='w') as f:
+            f.writelines(format_hex(image))
+    else:
+        raise ValueError(f'unknown image format {format}')
+
+def main(argv) -> int:
+    opts, args = gnu_getopt(argv, 'a:o:f:m:')
+    opts = dict(opts)
+    if not args:
+        print('usage: linker.py [-a address] [-o image] [-f bin|hex] [-m map] object ...', file=sys.stderr)
+        return 2
+
+    try:
+        # load address is hex as in the object program
+        image = link_files(args, int(opts.get('-a', '0'), 16))
+        if '-o' in opts:
+            write_image(opts['-o'], image, opts.get('-f', 'bin'))
+        if '-m' in opts:
+            with open(opts['-m'], mode='w') as f:
+                f.writelines(format_load_map(image))
+        elif '-o' not in opts:
+            sys.stdout.writelines(format_load_map(image))
+    except (OSError, SyntaxError, ValueError) as e:
+        print(f'linker.py: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
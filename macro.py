@@ -0,0 +1,135 @@
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+# parameter reference in a macro body token
+PARAMETER_PATTERN = re.compile(r'&[A-Za-z_][A-Za-z0-9_]*')
+
+# macro invoked inside an expansion may not nest deeper than this
+MAX_EXPANSION_DEPTH = 64
+
+# "AA", "AB", ... "ZZ", "BAA", ... prefix of local labels of one invocation
+def invocation_id(number) -> str:
+    letters = []
+    while number or len(letters) < 2:
+        letters.append(chr(ord('A') + number % 26))
+        number //= 26
+    return ''.join(reversed(letters))
+
+# "$LOOP" is local to one invocation, "#$LOOP" and "@$LOOP" refer to it
+def is_local_label(token) -> bool:
+    return token.lstrip('#@=+').startswith('$')
+
+# macro definition compiled once, body tokens are text or pieces with parameter numbers
+class MacroTemplate:
+    __slots__ = ('name', 'line', 'parameters', 'body', 'expansions')
+
+    def __init__(self, name: str, line: int, parameters: List[str], body: List[List[str]]) -> None:
+        self.name = name
+        self.line = line
+        self.parameters = parameters
+        self.body = [[self.__compile(token) for token in tokens] for tokens in body]
+        # argument tuple -> expanded lines and positions of local labels
+        self.expansions: Dict[Tuple[str, ...], List[Tuple[Tuple[str, ...], Tuple[int, ...]]]] = {}
+
+    def __compile(self, token) -> Union[str, tuple]:
+        pieces = []
+        position = 0
+        for match in PARAMETER_PATTERN.finditer(token):
+            if match.group() in self.parameters:
+                pieces += [token[position:match.start()], self.parameters.index(match.group())]
+                position = match.end()
+        if not pieces:
+            return token
+        pieces.append(token[position:])
+        return tuple(piece for piece in pieces if piece != '')
+
+    # body with arguments substituted, same arguments are expanded once
+    def expand(self, args: Tuple[str, ...]) -> List[Tuple[Tuple[str, ...], Tuple[int, ...]]]:
+        lines = self.expansions.get(args)
+        if lines is not None:
+            return lines
+        lines = []
+        for tokens in self.body:
+            expanded = []
+            for token in tokens:
+                if not isinstance(token, str):
+                    token = ''.join(piece if isinstance(piece, str) else args[piece] for piece in token)
+                # omitted argument leaves no token
+                if token:
+                    expanded.append(token)
+            if expanded:
+                locals_ = tuple(index for index, token in enumerate(expanded) if is_local_label(token))
+                lines.append((tuple(expanded), locals_))
+        self.expansions[args] = lines
+        return lines
+
+# expand MACRO/MEND definitions and invocations in a tokenized source stream
+#   mnemonics : opcode and directive names, a line starting with one has no label
+# expanded lines keep the line number of the invocation
+def expand_macros(lines: Iterable[Tuple[int, List[str]]], mnemonics=frozenset()) -> Iterator[Tuple[int, List[str]]]:
+    macros: Dict[str, MacroTemplate] = {}
+    invocations = 0
+
+    # body lines up to the MEND of this definition, nested definitions included
+    def read_definition(stream, line_no, tokens) -> MacroTemplate:
+        if len(tokens) < 2 or tokens[1] != 'MACRO':
+            raise SyntaxError(f'line {line_no}: MACRO must have name')
+        parameters = tokens[2:]
+        for parameter in parameters:
+            if PARAMETER_PATTERN.fullmatch(parameter) is None:
+                raise SyntaxError(f'line {line_no}: invalid macro parameter {parameter}')
+        if len(set(parameters)) != len(parameters):
+            raise SyntaxError(f'line {line_no}: duplicate macro parameter')
+
+        body = []
+        depth = 1
+        for _, body_tokens in stream:
+            if 'MACRO' in body_tokens[:2]:
+                depth += 1
+            elif body_tokens[0] == 'MEND':
+                depth -= 1
+                if depth == 0:
+                    return MacroTemplate(tokens[0], line_no, parameters, body)
+            body.append(body_tokens)
+        raise SyntaxError(f'line {line_no}: MACRO without MEND')
+
+    def process(stream, depth) -> Iterator[Tuple[int, List[str]]]:
+        nonlocal invocations
+        for line_no, tokens in stream:
+            if 'MACRO' in tokens[:2]:
+                template = read_definition(stream, line_no, tokens)
+                macros[template.name] = template
+                continue
+            if tokens[0] == 'MEND':
+                raise SyntaxError(f'line {line_no}: MEND without MACRO')
+
+            # "NAME args" or "LABEL NAME args"
+            if tokens[0] in macros:
+                label, template, args = None, macros[tokens[0]], tokens[1:]
+            elif len(tokens) > 1 and tokens[0] not in mnemonics and tokens[1] in macros:
+                label, template, args = tokens[0], macros[tokens[1]], tokens[2:]
+            else:
+                yield line_no, tokens
+                continue
+
+            if len(args) > len(template.parameters):
+                raise SyntaxError(f'line {line_no}: too many arguments for macro {template.name}')
+            if depth >= MAX_EXPANSION_DEPTH:
+                raise SyntaxError(f'line {line_no}: macro {template.name} nested too deep')
+            args = tuple(args) + ('',) * (len(template.parameters) - len(args))
+
+            # label of invocation names the first expanded location
+            if label is not None:
+                yield line_no, [label, 'EQU', '*']
+            prefix = '$' + invocation_id(invocations)
+            invocations += 1
+
+            expanded = []
+            for body_tokens, locals_ in template.expand(args):
+                body_tokens = list(body_tokens)
+                for index in locals_:
+                    body_tokens[index] = body_tokens[index].replace('$', prefix, 1)
+                expanded.append((line_no, body_tokens))
+            yield from process(iter(expanded), depth + 1)
+
+    yield from process(iter(lines), 0)
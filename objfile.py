@@ -0,0 +1,459 @@
+import os
+import sys
+import mmap
+import struct
+from bisect import bisect_right
+from getopt import gnu_getopt
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# max bytes of object code in one T record
+T_RECORD_SIZE = 30
+
+# binary object file layout, all integers little endian
+#   header   : magic, version, number of sections
+#   sections : fixed size entry per section, offsets are from file start
+#   tables   : text spans, EXTDEF, EXTREF and modification entries of each section
+#   code     : object code of each section, packed
+BINARY_MAGIC = b'SXOB'
+BINARY_VERSION = 1
+HEADER = struct.Struct('<4sHH')
+SECTION = struct.Struct('<8sIIiIIIIIIIIII')
+TEXT = struct.Struct('<III')        # location, start, end in section code
+EXTDEF = struct.Struct('<8sI')      # symbol, location
+EXTREF = struct.Struct('<8s')       # symbol
+MODIFIED = struct.Struct('<IBc8s')  # location, half bytes, sign, symbol
+
+# one control section of an object program
+class ObjectSection:
+    __slots__ = ('name', 'start', 'length', 'extdef', 'extref', 'code', 'text', 'modified', 'entry')
+
+    def __init__(self, name: str, start: int = 0, length: int = 0) -> None:
+        self.name = name
+        self.start = start
+        self.length = length
+        self.extdef = {}        # symbol -> location
+        self.extref = []        # symbols
+        self.code = bytearray() # object code, T records are spans of it
+        self.text = []          # (location, start, end) of code
+        self.modified = []      # (location, half bytes, '+SYMBOL' or '-SYMBOL')
+        self.entry = None       # E record address, only for the section with END
+
+    # T records as (location, view of code), long spans are split to T_RECORD_SIZE
+    def records(self) -> Iterator[Tuple[int, memoryview]]:
+        view = memoryview(self.code)
+        for location, start, end in self.text:
+            for offset in range(start, end, T_RECORD_SIZE):
+                yield location + offset - start, view[offset:min(offset + T_RECORD_SIZE, end)]
+
+    def __repr__(self) -> str:
+        return f'ObjectSection({self.name!r}, start={self.start:#x}, length={self.length:#x})'
+
+# text object program, H/D/R/T/M/E records
+def format_text(sections) -> Iterator[str]:
+    for section in sections:
+        # header
+        yield 'H{:<6s}{:06X}{:06X}\n'.format(section.name, section.start, section.length)
+
+        # external define
+        if section.extdef:
+            yield 'D' + ''.join(
+                '{:<6s}{:06X}'.format(label, value) for label, value in section.extdef.items()
+            ).strip() + '\n'
+
+        # external reference
+        if section.extref:
+            yield 'R' + ''.join('{:<6s}'.format(label) for label in section.extref).strip() + '\n'
+
+        # opcode
+        for location, content in section.records():
+            yield 'T{:06X}{:02X}{}\n'.format(location, len(content), content.hex().upper())
+
+        # modified record
+        for location, half_bytes, symbol in section.modified:
+            yield 'M{:06X}{:02X}{:<7s}'.format(location, half_bytes, symbol).strip() + '\n'
+
+        # END record
+        if section.entry is not None:
+            yield 'E{:06X}\n'.format(section.entry)
+        else:
+            yield 'E\n'
+
+        yield '\n'
+
+def write_text(file_name, sections) -> None:
+    with open(file_name, mode='w') as f:
+        f.writelines(format_text(sections))
+
+# parse text object program
+def parse_text(lines: Iterable[str]) -> List[ObjectSection]:
+    sections = []
+    section = None
+    for index, line in enumerate(lines):
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        record = line[0]
+        if record == 'H':
+            section = ObjectSection(line[1:7].rstrip(), int(line[7:13], 16), int(line[13:19], 16))
+            sections.append(section)
+        elif section is None:
+            raise SyntaxError(f'line {index + 1}: record before H record')
+        elif record == 'D':
+            for i in range(1, len(line), 12):
+                section.extdef[line[i:i + 6].rstrip()] = int(line[i + 6:i + 12], 16)
+        elif record == 'R':
+            section.extref += [line[i:i + 6].rstrip() for i in range(1, len(line), 6)]
+        elif record == 'T':
+            content = bytes.fromhex(line[9:9 + int(line[7:9], 16) * 2])
+            start = len(section.code)
+            section.code += content
+            section.text.append((int(line[1:7], 16), start, len(section.code)))
+        elif record == 'M':
+            section.modified.append((int(line[1:7], 16), int(line[7:9], 16), line[9:]))
+        elif record == 'E':
+            # entry may be left blank by one pass mode
+            section.entry = int(line[1:7], 16) if line[1:7].strip() else None
+        else:
+            raise SyntaxError(f'line {index + 1}: unknown record {record}')
+    return sections
+
+def read_text(file_name) -> List[ObjectSection]:
+    with open(file_name, mode='r') as f:
+        return parse_text(f)
+
+# memory mapped text object file, only H records are read until a section is asked for
+class TextObject:
+    def __init__(self, file_name) -> None:
+        self.__file = open(file_name, mode='rb')
+        size = os.fstat(self.__file.fileno()).st_size
+        # empty file can not be mapped
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.__offsets = {}     # section name -> (start, end) file offset
+        self.__sections = {}    # parsed sections by name
+        self.__index()
+
+    # offset of every H record, a section runs until the next one
+    def __index(self) -> None:
+        data = self.__mmap
+        starts = [0] if data[:1] == b'H' else []
+        position = data.find(b'\nH')
+        while position >= 0:
+            starts.append(position + 1)
+            position = data.find(b'\nH', position + 1)
+        starts.append(len(data))
+        for start, end in zip(starts, starts[1:]):
+            self.__offsets[bytes(data[start + 1:start + 7]).decode('ascii').rstrip()] = (start, end)
+
+    def names(self) -> List[str]:
+        return list(self.__offsets)
+
+    def section(self, name) -> ObjectSection:
+        section = self.__sections.get(name)
+        if section is None:
+            start, end = self.__offsets[name]
+            section = self.__sections[name] = parse_text(
+                bytes(self.__mmap[start:end]).decode('ascii').splitlines())[0]
+        return section
+
+    @property
+    def sections(self) -> List[ObjectSection]:
+        return [self.section(name) for name in self.__offsets]
+
+    def close(self) -> None:
+        if isinstance(self.__mmap, mmap.mmap):
+            self.__mmap.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+# T records of a section sorted by location, byte lookup is a binary search
+class TextIndex:
+    def __init__(self, section: ObjectSection) -> None:
+        self.spans = sorted(section.text)
+        self.__locations = [location for location, _, _ in self.spans]
+        self.__code = section.code
+
+    # span (location, start, end) holding location
+    def find(self, location) -> Optional[Tuple[int, int, int]]:
+        index = bisect_right(self.__locations, location) - 1
+        if index < 0:
+            return None
+        span = self.spans[index]
+        return span if location < span[0] + span[2] - span[1] else None
+
+    def byte(self, location) -> Optional[int]:
+        span = self.find(location)
+        return None if span is None else self.__code[span[1] + location - span[0]]
+
+    # size bytes from location, may run over adjacent T records; None when any byte is missing
+    def read(self, location, size) -> Optional[bytes]:
+        data = bytearray()
+        while len(data) < size:
+            span = self.find(location + len(data))
+            if span is None:
+                return None
+            start = span[1] + location + len(data) - span[0]
+            data += self.__code[start:min(span[2], start + size - len(data))]
+        return bytes(data)
+
+# text object program written while it is assembled, fields not known yet are patched in place
+class TextStream:
+    def __init__(self, file) -> None:
+        self.file = file            # binary file, must be seekable
+        self.started = False        # header of current section is written
+        self.held = {}              # location -> file offset of code waiting for patch
+        self.__section = None       # (name, start, extdef, extref) of current section
+        self.__length_offset = None # file offset of H record length
+        self.__extdef_offset = {}   # symbol -> file offset of D record value
+        self.__entry_offset = None  # file offset of E record waiting for entry
+        self.__location = None      # location of buffered T record
+        self.__buffer = bytearray() # code of buffered T record
+        self.__holding = []         # held locations in buffered T record
+
+    def __write(self, text) -> int:
+        offset = self.file.tell()
+        self.file.write(text.encode('ascii'))
+        return offset
+
+    def __overwrite(self, offset, text) -> None:
+        self.file.seek(offset)
+        self.file.write(text.encode('ascii'))
+        self.file.seek(0, 2)
+
+    # extdef and extref may grow until the first code is written
+    def begin(self, name, start, extdef, extref) -> None:
+        self.__section = (name, start, extdef, extref)
+        self.started = False
+
+    def __write_header(self) -> None:
+        name, start, extdef, extref = self.__section
+        self.started = True
+        # length is known when section ends
+        self.__length_offset = self.__write('H{:<6s}{:06X}'.format(name, start)) + 13
+        self.__write('000000\n')
+
+        self.__extdef_offset = {}
+        if extdef:
+            offset = self.__write('D') + 1
+            for label in extdef:
+                field = '{:<6s}'.format(label)
+                self.__extdef_offset[label] = offset + len(field)
+                offset += len(field) + 6
+                self.__write(field + '000000')
+            self.__write('\n')
+
+        if extref:
+            self.__write('R' + ''.join('{:<6s}'.format(label) for label in extref).strip() + '\n')
+
+    def __flush(self) -> None:
+        if self.__buffer:
+            offset = self.__write('T{:06X}{:02X}{}\n'.format(
+                self.__location, len(self.__buffer), self.__buffer.hex().upper())) + 9
+            for location in self.__holding:
+                self.held[location] = offset + (location - self.__location) * 2
+        self.__location = None
+        self.__buffer = bytearray()
+        self.__holding = []
+
+    # append code, held code is patched later; gap or full record starts a new T record
+    def code(self, location, data, hold=False) -> None:
+        if not self.started:
+            self.__write_header()
+        if (self.__location is None or location != self.__location + len(self.__buffer)
+                or len(self.__buffer) + len(data) > T_RECORD_SIZE):
+            self.__flush()
+            self.__location = location
+        if hold:
+            self.__holding.append(location)
+        self.__buffer += data
+
+    def patch(self, location, data) -> None:
+        if location in self.__holding:
+            start = location - self.__location
+            self.__buffer[start:start + len(data)] = data
+            self.__holding.remove(location)
+        else:
+            self.__overwrite(self.held.pop(location), data.hex().upper())
+
+    # finish section, hold_entry leaves E record address for set_entry
+    def end(self, length, extdef, modified, entry=None, hold_entry=False) -> None:
+        if not self.started:
+            self.__write_header()
+        self.__flush()
+        for location, half_bytes, symbol in modified:
+            self.__write('M{:06X}{:02X}{:<7s}'.format(location, half_bytes, symbol).strip() + '\n')
+        if hold_entry:
+            self.__entry_offset = self.__write('E') + 1
+            self.__write('000000\n')
+        elif entry is not None:
+            self.__write('E{:06X}\n'.format(entry))
+        else:
+            self.__write('E\n')
+        self.__write('\n')
+
+        self.__overwrite(self.__length_offset, '{:06X}'.format(length))
+        for label, offset in self.__extdef_offset.items():
+            self.__overwrite(offset, '{:06X}'.format(extdef[label]))
+        self.held.clear()
+        self.__section = None
+
+    # address of held E record, blank when entry is in another section
+    def set_entry(self, entry) -> None:
+        if self.__entry_offset is not None:
+            self.__overwrite(self.__entry_offset, '{:06X}'.format(entry) if entry is not None else ' ' * 6)
+            self.__entry_offset = None
+
+def encode_name(name) -> bytes:
+    data = name.encode('ascii')
+    if len(data) > 8:
+        raise ValueError(f'symbol {name} longer than 8 characters')
+    return data
+
+def decode_name(data) -> str:
+    return bytes(data).rstrip(b'\0').decode('ascii')
+
+# binary object program
+def format_binary(sections) -> bytearray:
+    sections = list(sections)
+    data = bytearray(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(sections)))
+    table_offset = len(data)
+    data += bytes(SECTION.size * len(sections))
+
+    for index, section in enumerate(sections):
+        text_offset = len(data)
+        for span in section.text:
+            data += TEXT.pack(*span)
+        extdef_offset = len(data)
+        for symbol, location in section.extdef.items():
+            data += EXTDEF.pack(encode_name(symbol), location)
+        extref_offset = len(data)
+        for symbol in section.extref:
+            data += EXTREF.pack(encode_name(symbol))
+        modified_offset = len(data)
+        for location, half_bytes, symbol in section.modified:
+            data += MODIFIED.pack(location, half_bytes, symbol[0].encode('ascii'), encode_name(symbol[1:]))
+        code_offset = len(data)
+        data += section.code
+
+        SECTION.pack_into(
+            data, table_offset + index * SECTION.size,
+            encode_name(section.name), section.start, section.length,
+            section.entry if section.entry is not None else -1,
+            code_offset, len(section.code),
+            text_offset, len(section.text),
+            extdef_offset, len(section.extdef),
+            extref_offset, len(section.extref),
+            modified_offset, len(section.modified),
+        )
+    return data
+
+def write_binary(file_name, sections) -> None:
+    with open(file_name, mode='wb') as f:
+        f.write(format_binary(sections))
+
+# parse binary object program, code of each section is a view of data
+def parse_binary(data) -> List[ObjectSection]:
+    view = memoryview(data)
+    magic, version, count = HEADER.unpack_from(view, 0)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError('not a binary object file')
+
+    sections = []
+    for index in range(count):
+        (name, start, length, entry, code_offset, code_size, text_offset, text_count,
+         extdef_offset, extdef_count, extref_offset, extref_count,
+         modified_offset, modified_count) = SECTION.unpack_from(view, HEADER.size + index * SECTION.size)
+
+        section = ObjectSection(decode_name(name), start, length)
+        section.entry = entry if entry >= 0 else None
+        section.code = view[code_offset:code_offset + code_size]
+        section.text = list(TEXT.iter_unpack(view[text_offset:text_offset + text_count * TEXT.size]))
+        section.extdef = {
+            decode_name(symbol): location for symbol, location
+            in EXTDEF.iter_unpack(view[extdef_offset:extdef_offset + extdef_count * EXTDEF.size])
+        }
+        section.extref = [
+            decode_name(symbol) for symbol,
+            in EXTREF.iter_unpack(view[extref_offset:extref_offset + extref_count * EXTREF.size])
+        ]
+        section.modified = [
+            (location, half_bytes, sign.decode('ascii') + decode_name(symbol))
+            for location, half_bytes, sign, symbol
+            in MODIFIED.iter_unpack(view[modified_offset:modified_offset + modified_count * MODIFIED.size])
+        ]
+        sections.append(section)
+    return sections
+
+# memory mapped binary object file, section code is not copied
+class BinaryObject:
+    def __init__(self, file_name) -> None:
+        self.__file = open(file_name, mode='rb')
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.sections = parse_binary(self.__mmap)
+
+    def names(self) -> List[str]:
+        return [section.name for section in self.sections]
+
+    def section(self, name) -> ObjectSection:
+        for section in self.sections:
+            if section.name == name:
+                return section
+        raise KeyError(name)
+
+    # views of the mapping must be released before close
+    def close(self) -> None:
+        for section in self.sections:
+            section.code.release()
+        self.sections = []
+        self.__mmap.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+def is_binary(file_name) -> bool:
+    with open(file_name, mode='rb') as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+# mapped object file of either format
+def open_object(file_name):
+    return BinaryObject(file_name) if is_binary(file_name) else TextObject(file_name)
+
+# read text or binary object program, binary is copied out of the file
+def read_object(file_name) -> List[ObjectSection]:
+    if not is_binary(file_name):
+        return read_text(file_name)
+    with open(file_name, mode='rb') as f:
+        return parse_binary(f.read())
+
+def write_object(file_name, sections, format='text') -> None:
+    if format == 'bin':
+        write_binary(file_name, sections)
+    elif format == 'text':
+        write_text(file_name, sections)
+    else:
+        raise ValueError(f'unknown object format {format}')
+
+# convert object program between text and binary format
+def main(argv) -> int:
+    opts, args = gnu_getopt(argv, 'o:f:')
+    opts = dict(opts)
+    if len(args) != 1 or '-o' not in opts:
+        print('usage: objfile.py [-f text|bin] input -o output', file=sys.stderr)
+        return 2
+
+    read_file = args[0]
+    # default converts to the other format
+    format = opts.get('-f', 'text' if is_binary(read_file) else 'bin')
+    write_object(opts['-o'], read_object(read_file), format)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import queue
+import base64
+import signal
+import threading
+import socketserver
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from getopt import gnu_getopt
+
+from assembler import Assembler, error_message
+
+# request and response are one JSON object per line
+#   request  : {"id": any, "name": "file.asm", "path": "/abs/file.asm", "source": "...", "format": "text" | "bin"}
+#   path is where INCLUDE is resolved from, the server working directory when it is missing
+#   response : {"id": any, "ok": true, "object": "..."} or {"id": any, "ok": false, "error": "..."}
+# binary object program is base64 encoded
+
+# warm assembler of this worker, opcode table is parsed once
+_assembler = None
+
+def init_worker(opcode_path) -> None:
+    global _assembler
+    _assembler = Assembler(opcode_path)
+
+# assemble one request, failure is returned as error message
+def handle_request(request) -> dict:
+    response = {'id': request.get('id'), 'ok': True}
+    name = request.get('name', '<source>')
+    try:
+        program = _assembler.assemble(request['source'], request.get('path'))
+        format = request.get('format', 'text')
+        if format == 'text':
+            response['object'] = program.text()
+        elif format == 'bin':
+            response['object'] = base64.b64encode(program.binary()).decode('ascii')
+        else:
+            raise ValueError(f'unknown object format {format}')
+    except Exception as e:
+        response['ok'] = False
+        response['error'] = error_message(name, _assembler, e)
+    return response
+
+# one worker runs in the server process, more workers are processes
+def make_executor(jobs, opcode_path):
+    if jobs > 1:
+        return ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(opcode_path,))
+    return ThreadPoolExecutor(1, initializer=init_worker, initargs=(opcode_path,))
+
+def submit_line(executor, line) -> Future:
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict) or not isinstance(request.get('source'), str):
+            raise ValueError('request must be an object with "source"')
+    except ValueError as e:
+        future = Future()
+        future.set_result({'id': None, 'ok': False, 'error': f'invalid request: {e}'})
+        return future
+    return executor.submit(handle_request, request)
+
+# requests of a stream are assembled concurrently, responses keep request order
+def serve_stream(executor, rfile, wfile) -> None:
+    futures = queue.Queue()
+
+    def write_responses() -> None:
+        while True:
+            future = futures.get()
+            if future is None:
+                return
+            try:
+                response = future.result()
+            except Exception as e:
+                # worker process died
+                response = {'id': None, 'ok': False, 'error': f'{type(e).__name__}: {e}'}
+            try:
+                wfile.write(json.dumps(response).encode() + b'\n')
+                wfile.flush()
+            except OSError:
+                pass
+
+    writer = threading.Thread(target=write_responses)
+    writer.start()
+    try:
+        for line in rfile:
+            if line.strip():
+                futures.put(submit_line(executor, line))
+    finally:
+        futures.put(None)
+        writer.join()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        serve_stream(self.server.executor, self.rfile, self.wfile)
+
+class AssemblerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, executor) -> None:
+        self.executor = executor
+        # socket file left by previous server
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, RequestHandler)
+
+def main(argv) -> int:
+    opts, args = gnu_getopt(argv, 'j:', ['socket=', 'stdio', 'opcode='])
+    opts = dict(opts)
+    if args or ('--socket' in opts) == ('--stdio' in opts):
+        print('usage: server.py (--socket path | --stdio) [-j jobs] [--opcode file]', file=sys.stderr)
+        return 2
+
+    jobs = int(opts.get('-j', os.cpu_count() or 1))
+    with make_executor(jobs, opts.get('--opcode')) as executor:
+        if '--stdio' in opts:
+            serve_stream(executor, sys.stdin.buffer, sys.stdout.buffer)
+            return 0
+
+        path = opts['--socket']
+        # stop on kill as on ctrl-c, socket file is removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        with AssemblerServer(path, executor) as server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.remove(path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
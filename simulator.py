@@ -0,0 +1,465 @@
+import sys
+import math
+import time
+from getopt import gnu_getopt
+from typing import Dict, List, Tuple
+
+from assembler import REGISTER_CODE, load_opcode_table
+from linker import LoadImage, link_files
+
+MEMORY_SIZE = 1 << 20       # SIC/XE memory is 1 MB
+WORD_MASK = 0xFFFFFF
+# L register starts here, returning to it stops the program
+HALT_ADDRESS = MEMORY_SIZE
+
+A, X, L, B, S, T, F, PC, SW = (REGISTER_CODE[name] for name in ['A', 'X', 'L', 'B', 'S', 'T', 'F', 'PC', 'SW'])
+
+# predecoded instruction entry fields
+HANDLER, LENGTH, NI, INDEX, BASE, RELATIVE, DISP, R1, R2, COUNT, MNEMONIC = range(11)
+
+def to_signed(value) -> int:
+    return value - (1 << 24) if value & 0x800000 else value
+
+def compare(left, right) -> int:
+    left, right = to_signed(left), to_signed(right)
+    return (left > right) - (left < right)
+
+# 48 bit float: sign, 11 bit exponent biased by 1024, 36 bit fraction 0.f
+def float_from_bytes(data) -> float:
+    bits = int.from_bytes(data, 'big')
+    fraction = bits & ((1 << 36) - 1)
+    if fraction == 0:
+        return 0.0
+    value = math.ldexp(fraction, ((bits >> 36) & 0x7FF) - 1024 - 36)
+    return -value if bits >> 47 else value
+
+def float_to_bytes(value) -> bytes:
+    if value == 0:
+        return bytes(6)
+    mantissa, exponent = math.frexp(abs(value))
+    fraction = round(mantissa * (1 << 36))
+    if fraction >> 36:
+        fraction >>= 1
+        exponent += 1
+    exponent = min(max(exponent + 1024, 0), 0x7FF)
+    return ((value < 0) << 47 | exponent << 36 | fraction).to_bytes(6, 'big')
+
+# device of RD/WD/TD, reading past input gives 0
+class Device:
+    def __init__(self, data: bytes = b'') -> None:
+        self.input = data
+        self.position = 0
+        self.output = bytearray()
+
+    def read(self) -> int:
+        if self.position >= len(self.input):
+            return 0
+        self.position += 1
+        return self.input[self.position - 1]
+
+    def write(self, byte) -> None:
+        self.output.append(byte)
+
+# semantics of every SIC/XE opcode, keyed by opcode value
+def build_handlers() -> dict:
+    handlers = {}
+
+    # format 3/4 memory operand
+    def load(register):
+        def handler(sim, entry):
+            sim.reg[register] = sim.word_operand(entry)
+        return handler
+
+    def store(register):
+        def handler(sim, entry):
+            sim.write(sim.target(entry), sim.reg[register].to_bytes(3, 'big'))
+        return handler
+
+    def arithmetic(operation):
+        def handler(sim, entry):
+            sim.reg[A] = operation(sim.reg[A], sim.word_operand(entry)) & WORD_MASK
+        return handler
+
+    def jump(condition):
+        def handler(sim, entry):
+            if condition is None or sim.cc == condition:
+                sim.jump(sim.target(entry))
+        return handler
+
+    def divide(left, right):
+        if to_signed(right) == 0:
+            raise ZeroDivisionError('division by zero')
+        quotient = abs(to_signed(left)) // abs(to_signed(right))
+        return quotient if (to_signed(left) < 0) == (to_signed(right) < 0) else -quotient
+
+    for code, register in [(0x00, A), (0x68, B), (0x08, L), (0x6C, S), (0x74, T), (0x04, X)]:
+        handlers[code] = load(register)
+    for code, register in [(0x0C, A), (0x78, B), (0x14, L), (0x7C, S), (0x84, T), (0x10, X), (0xE8, SW)]:
+        handlers[code] = store(register)
+    handlers[0x18] = arithmetic(lambda a, m: a + m)                 # ADD
+    handlers[0x1C] = arithmetic(lambda a, m: a - m)                 # SUB
+    handlers[0x20] = arithmetic(lambda a, m: to_signed(a) * to_signed(m))  # MUL
+    handlers[0x24] = arithmetic(divide)                             # DIV
+    handlers[0x40] = arithmetic(lambda a, m: a & m)                 # AND
+    handlers[0x44] = arithmetic(lambda a, m: a | m)                 # OR
+    handlers[0x3C] = jump(None)                                     # J
+    handlers[0x30] = jump(0)                                        # JEQ
+    handlers[0x34] = jump(1)                                        # JGT
+    handlers[0x38] = jump(-1)                                       # JLT
+
+    def comp(sim, entry):
+        sim.cc = compare(sim.reg[A], sim.word_operand(entry))
+
+    def tix(sim, entry):
+        sim.reg[X] = (sim.reg[X] + 1) & WORD_MASK
+        sim.cc = compare(sim.reg[X], sim.word_operand(entry))
+
+    def jsub(sim, entry):
+        sim.reg[L] = sim.reg[PC]
+        sim.jump(sim.target(entry))
+
+    def rsub(sim, entry):
+        sim.jump(sim.reg[L])
+
+    def ldch(sim, entry):
+        sim.reg[A] = (sim.reg[A] & 0xFFFF00) | sim.byte_operand(entry)
+
+    def stch(sim, entry):
+        sim.write(sim.target(entry), bytes([sim.reg[A] & 0xFF]))
+
+    # device is always ready
+    def td(sim, entry):
+        sim.device(sim.byte_operand(entry))
+        sim.cc = -1
+
+    def rd(sim, entry):
+        sim.reg[A] = (sim.reg[A] & 0xFFFF00) | sim.device(sim.byte_operand(entry)).read()
+
+    def wd(sim, entry):
+        sim.device(sim.byte_operand(entry)).write(sim.reg[A] & 0xFF)
+
+    handlers.update({
+        0x28: comp, 0x2C: tix, 0x48: jsub, 0x4C: rsub,
+        0x50: ldch, 0x54: stch, 0xE0: td, 0xD8: rd, 0xDC: wd,
+    })
+
+    # floating point
+    def float_arithmetic(operation):
+        def handler(sim, entry):
+            sim.f = operation(sim.f, sim.float_operand(entry))
+        return handler
+
+    def divf(f, m):
+        if m == 0:
+            raise ZeroDivisionError('division by zero')
+        return f / m
+
+    def compf(sim, entry):
+        operand = sim.float_operand(entry)
+        sim.cc = (sim.f > operand) - (sim.f < operand)
+
+    def ldf(sim, entry):
+        sim.f = sim.float_operand(entry)
+
+    def stf(sim, entry):
+        sim.write(sim.target(entry), float_to_bytes(sim.f))
+
+    handlers.update({
+        0x58: float_arithmetic(lambda f, m: f + m),     # ADDF
+        0x5C: float_arithmetic(lambda f, m: f - m),     # SUBF
+        0x60: float_arithmetic(lambda f, m: f * m),     # MULF
+        0x64: float_arithmetic(divf),                   # DIVF
+        0x88: compf, 0x70: ldf, 0x80: stf,
+    })
+
+    # privileged instructions only touch state the simulator does not model
+    def nothing(sim, entry):
+        pass
+
+    for code in [0xD0, 0xD4, 0xEC]:     # LPS, STI, SSK
+        handlers[code] = nothing
+
+    # format 1
+    def fix(sim, entry):
+        sim.reg[A] = int(sim.f) & WORD_MASK
+
+    def float_(sim, entry):
+        sim.f = float(to_signed(sim.reg[A]))
+
+    # I/O channel is always idle
+    def channel(sim, entry):
+        sim.cc = 0
+
+    handlers.update({0xC4: fix, 0xC0: float_, 0xC8: nothing, 0xF4: channel, 0xF0: channel, 0xF8: channel})
+
+    # format 2
+    def register_arithmetic(operation):
+        def handler(sim, entry):
+            sim.reg[entry[R2]] = operation(sim.reg[entry[R2]], sim.reg[entry[R1]]) & WORD_MASK
+        return handler
+
+    def compr(sim, entry):
+        sim.cc = compare(sim.reg[entry[R1]], sim.reg[entry[R2]])
+
+    def clear(sim, entry):
+        sim.reg[entry[R1]] = 0
+
+    def rmo(sim, entry):
+        sim.reg[entry[R2]] = sim.reg[entry[R1]]
+
+    # circular left shift
+    def shiftl(sim, entry):
+        value, count = sim.reg[entry[R1]], (entry[R2] + 1) % 24
+        sim.reg[entry[R1]] = ((value << count) | (value >> (24 - count))) & WORD_MASK
+
+    # arithmetic right shift
+    def shiftr(sim, entry):
+        sim.reg[entry[R1]] = (to_signed(sim.reg[entry[R1]]) >> (entry[R2] + 1)) & WORD_MASK
+
+    def tixr(sim, entry):
+        sim.reg[X] = (sim.reg[X] + 1) & WORD_MASK
+        sim.cc = compare(sim.reg[X], sim.reg[entry[R1]])
+
+    def svc(sim, entry):
+        sim.halt(f'SVC {entry[R1]}')
+
+    handlers.update({
+        0x90: register_arithmetic(lambda r2, r1: r2 + r1),                          # ADDR
+        0x94: register_arithmetic(lambda r2, r1: r2 - r1),                          # SUBR
+        0x98: register_arithmetic(lambda r2, r1: to_signed(r2) * to_signed(r1)),    # MULR
+        0x9C: register_arithmetic(divide),                                          # DIVR
+        0xA0: compr, 0xB4: clear, 0xAC: rmo, 0xA4: shiftl, 0xA8: shiftr, 0xB8: tixr, 0xB0: svc,
+    })
+    return handlers
+
+HANDLERS = build_handlers()
+
+# SIC/XE machine, instructions are decoded once per address until their bytes are written
+class Simulator:
+    def __init__(self, opcode_path=None, memory_size=MEMORY_SIZE) -> None:
+        self.memory = bytearray(memory_size)
+        self.reg = [0] * 10         # by register number, F is kept in f
+        self.f = 0.0
+        self.cc = 0                 # condition code: -1 <, 0 =, 1 >
+        self.devices: Dict[int, Device] = {}
+        self.halted = None          # reason the program stopped
+        self.instructions = 0       # executed instructions
+        self.seconds = 0.0
+        self.invalidations = 0      # cached instructions dropped by writes
+        self.__cache = {}           # address -> predecoded entry
+        self.__code_bytes = {}      # address of every cached byte -> entry address
+        self.__retired = {}         # address -> [count, mnemonic] of invalidated entries
+
+        # opcode value -> (mnemonic, format, handler)
+        self.__opcode = {}
+        for mnemonic, opcode in load_opcode_table(opcode_path).opcode.items():
+            handler = HANDLERS.get(opcode.code)
+            if handler is None:
+                raise ValueError(f'no semantics for opcode {mnemonic}')
+            self.__opcode[opcode.code] = (mnemonic, opcode.format[0], handler)
+
+    # put linked image in memory, execution starts at its entry
+    def load(self, image: LoadImage) -> None:
+        self.write(image.address, image.memory)
+        self.reg[PC] = image.entry
+        self.reg[L] = HALT_ADDRESS
+        self.halted = None
+
+    def device(self, number) -> Device:
+        device = self.devices.get(number)
+        if device is None:
+            device = self.devices[number] = Device()
+        return device
+
+    def halt(self, reason) -> None:
+        self.halted = reason
+
+    def jump(self, address) -> None:
+        self.reg[PC] = address
+
+    # write memory, cached instructions over written bytes are decoded again
+    def write(self, address, data) -> None:
+        end = address + len(data)
+        if address < 0 or end > len(self.memory):
+            raise IndexError(f'address {address:06X} out of memory')
+        self.memory[address:end] = data
+        code_bytes = self.__code_bytes
+        if not code_bytes:
+            return
+        for byte in range(address, end):
+            start = code_bytes.get(byte)
+            if start is not None:
+                self.__invalidate(start)
+
+    def __invalidate(self, start) -> None:
+        entry = self.__cache.pop(start)
+        for byte in range(start, start + entry[LENGTH]):
+            del self.__code_bytes[byte]
+        retired = self.__retired.setdefault(start, [0, None])
+        retired[0] += entry[COUNT]
+        retired[1] = entry[MNEMONIC]
+        self.invalidations += 1
+
+    def read_word(self, address) -> int:
+        if address < 0 or address + 3 > len(self.memory):
+            raise IndexError(f'address {address:06X} out of memory')
+        return int.from_bytes(self.memory[address:address + 3], 'big')
+
+    # target address of format 3/4 or SIC instruction, indirect address is followed
+    def target(self, entry) -> int:
+        address = entry[DISP]
+        if entry[RELATIVE]:
+            address += self.reg[PC]
+        elif entry[BASE]:
+            address += self.reg[B]
+        if entry[INDEX]:
+            address += self.reg[X]
+        address &= 0xFFFFF
+        if entry[NI] == 2:
+            address = self.read_word(address)
+        return address
+
+    def word_operand(self, entry) -> int:
+        if entry[NI] == 1:
+            return self.target(entry) & WORD_MASK
+        return self.read_word(self.target(entry))
+
+    def byte_operand(self, entry) -> int:
+        if entry[NI] == 1:
+            return self.target(entry) & 0xFF
+        return self.memory[self.target(entry)]
+
+    def float_operand(self, entry) -> float:
+        if entry[NI] == 1:
+            return float(self.target(entry))
+        address = self.target(entry)
+        return float_from_bytes(self.memory[address:address + 6])
+
+    def __decode(self, address) -> list:
+        memory = self.memory
+        if address < 0 or address >= len(memory):
+            raise IndexError(f'address {address:06X} out of memory')
+        first = memory[address]
+        opcode = self.__opcode.get(first & 0xFC)
+        if opcode is None:
+            raise ValueError(f'{address:06X}: invalid opcode {first:02X}')
+        mnemonic, format, handler = opcode
+        entry = [handler, format, 0, 0, 0, 0, 0, 0, 0, 0, mnemonic]
+        if format == 2:
+            entry[R1], entry[R2] = memory[address + 1] >> 4, memory[address + 1] & 0xF
+        elif format == 3:
+            second, third = memory[address + 1], memory[address + 2]
+            entry[NI] = first & 3
+            if entry[NI] == 0:
+                # SIC instruction, 15 bit address with x
+                entry[NI] = 3
+                entry[INDEX] = second >> 7
+                entry[DISP] = (second & 0x7F) << 8 | third
+            else:
+                entry[INDEX], entry[BASE], entry[RELATIVE] = second >> 7 & 1, second >> 6 & 1, second >> 5 & 1
+                if second & 0x10:
+                    entry[LENGTH] = 4
+                    entry[DISP] = (second & 0xF) << 16 | third << 8 | memory[address + 3]
+                else:
+                    disp = (second & 0xF) << 8 | third
+                    # PC relative displacement is signed
+                    entry[DISP] = disp - 0x1000 if entry[RELATIVE] and disp & 0x800 else disp
+            entry[MNEMONIC] = mnemonic if entry[LENGTH] == 3 else '+' + mnemonic
+
+        self.__cache[address] = entry
+        for byte in range(address, address + entry[LENGTH]):
+            self.__code_bytes[byte] = address
+        return entry
+
+    # run until halt or max_steps instructions, return instructions executed
+    def run(self, max_steps=None) -> int:
+        reg = self.reg
+        cache = self.__cache
+        decode = self.__decode
+        steps = 0
+        pc = reg[PC]
+        start = time.perf_counter()
+        try:
+            while self.halted is None and (max_steps is None or steps < max_steps):
+                pc = reg[PC]
+                if pc == HALT_ADDRESS:
+                    self.halted = 'return'
+                    break
+                entry = cache.get(pc)
+                if entry is None:
+                    entry = decode(pc)
+                entry[COUNT] += 1
+                reg[PC] = pc + entry[LENGTH]
+                entry[HANDLER](self, entry)
+                steps += 1
+                # jump to itself, "HALT J HALT", ends program
+                if reg[PC] == pc:
+                    self.halted = 'loop'
+        except (ArithmeticError, IndexError, ValueError) as e:
+            raise RuntimeError(f'{pc:06X}: {e}') from e
+        finally:
+            self.instructions += steps
+            self.seconds += time.perf_counter() - start
+        return steps
+
+    def instructions_per_second(self) -> float:
+        return self.instructions / self.seconds if self.seconds else 0.0
+
+    # most executed addresses as (address, mnemonic, count)
+    def hot_addresses(self, count=10) -> List[Tuple[int, str, int]]:
+        counts = {address: list(retired) for address, retired in self.__retired.items()}
+        for address, entry in self.__cache.items():
+            counted = counts.setdefault(address, [0, None])
+            counted[0] += entry[COUNT]
+            counted[1] = entry[MNEMONIC]
+        hot = sorted(counts.items(), key=lambda item: -item[1][0])[:count]
+        return [(address, mnemonic, executed) for address, (executed, mnemonic) in hot]
+
+# "F1=file" device option
+def parse_device(text) -> Tuple[int, str]:
+    number, _, file_name = text.partition('=')
+    return int(number, 16), file_name
+
+def main(argv) -> int:
+    opts, args = gnu_getopt(argv, 'a:n:', ['in=', 'out=', 'hot=', 'opcode='])
+    if not args:
+        print('usage: simulator.py [-a address] [-n steps] [--in F1=file] [--out 05=file] [--hot N] object ...',
+              file=sys.stderr)
+        return 2
+    options = dict(opts)
+
+    try:
+        sim = Simulator(options.get('--opcode'))
+        sim.load(link_files(args, int(options.get('-a', '0'), 16)))
+        outputs = []
+        for opt, value in opts:
+            number, file_name = parse_device(value)
+            if opt == '--in':
+                with open(file_name, mode='rb') as f:
+                    sim.devices[number] = Device(f.read())
+            elif opt == '--out':
+                outputs.append((number, file_name))
+
+        sim.run(int(options['-n']) if '-n' in options else None)
+        for number, file_name in outputs:
+            with open(file_name, mode='wb') as f:
+                f.write(sim.device(number).output)
+    except (OSError, SyntaxError, ValueError, RuntimeError) as e:
+        print(f'simulator.py: {e}', file=sys.stderr)
+        return 1
+
+    print('halted      {}'.format(sim.halted or 'step limit'), file=sys.stderr)
+    print('instructions {:d}  seconds {:.4f}  ips {:.0f}'.format(
+        sim.instructions, sim.seconds, sim.instructions_per_second()), file=sys.stderr)
+    print('registers   ' + ' '.join(
+        '{}={:06X}'.format(name, sim.reg[REGISTER_CODE[name]]) for name in ['A', 'X', 'L', 'B', 'S', 'T', 'PC']),
+        file=sys.stderr)
+    hot = int(options.get('--hot', 10))
+    if hot:
+        print('{:<8s}{:<8s}{:>12s}'.format('address', 'opcode', 'executed'), file=sys.stderr)
+        for address, mnemonic, count in sim.hot_addresses(hot):
+            print('{:06X}  {:<8s}{:>12d}'.format(address, mnemonic, count), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
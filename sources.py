@@ -0,0 +1,26 @@
+import os
+import glob
+from typing import List
+
+# command line inputs shared by assembler.py and client.py, kept small so the client starts fast
+
+# expand file, directory and glob arguments into source files
+def collect_sources(args) -> List[str]:
+    sources = []
+    for arg in args:
+        if os.path.isdir(arg):
+            sources += sorted(glob.glob(os.path.join(arg, '*.asm')))
+        elif glob.has_magic(arg):
+            sources += sorted(glob.glob(arg))
+        else:
+            sources.append(arg)
+    return sources
+
+# several inputs, a directory or a glob make -o an output directory
+def is_batch(args) -> bool:
+    return len(args) > 1 or any(os.path.isdir(arg) or glob.has_magic(arg) for arg in args)
+
+# output/<name> for input/<name>.asm
+def output_name(output_dir, read_file) -> str:
+    name = os.path.splitext(os.path.basename(read_file))[0]
+    return os.path.join(output_dir, name)